@@ -1,16 +1,24 @@
+import datetime
+import functools
+import json
 import re
+import threading
 import urllib
+from decimal import Decimal
 
 from flask import (
     Flask, render_template, abort, request,
-    escape, Markup, redirect, url_for
+    escape, Markup, redirect, url_for, jsonify
 )
 from flask.ext.sqlalchemy import SQLAlchemy
+import sqlalchemy as sa
 from werkzeug import url_encode
 
 import sa_common
 import config
 from html_output_fn import date_since
+from response_cache import ResponseCache
+from code_cache import CodeCache
 
 
 app = Flask(__name__)
@@ -56,7 +64,7 @@ def make_html_span(name, cls):
 
 
 def code_desc(arg, code_type):
-    codes = codes_data.get(code_type)
+    codes = code_cache.get(code_type)
     if not codes:
         return arg
     if arg is not None:
@@ -128,6 +136,47 @@ def get_primary_keys(*args, **kw):
     return sa_common.get_primary_keys(db.engine, *args, **kw)
 
 
+catalog = sa_common.Catalog(db.engine)
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_SIZE)
+
+# latest update of the tables, everything they are built from and the
+# c_* tables the code descriptions in responses come from
+tables_version_sql = '''
+    WITH RECURSIVE deps(name) AS (
+        SELECT unnest(CAST(:tables AS text[]))
+        UNION
+        SELECT unnest(s.dependencies)
+        FROM table_summaries s
+        JOIN deps d ON d.name = s.name
+    )
+    SELECT max(s.updated), count(*)
+    FROM table_summaries s
+    WHERE s.name IN (SELECT name FROM deps)
+    OR left(s.name, 2) = 'c_'
+'''
+
+
+def cached(*tables):
+    ''' Cache the response of a route, keyed on its path and arguments,
+    until one of tables, anything they depend on or a code table is
+    updated '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            key = (request.path, request.query_string)
+            version = tuple(
+                run_sql(tables_version_sql, tables=list(tables)).first()
+            )
+            response = response_cache.get(key, version)
+            if response is None:
+                response = fn(*args, **kw)
+                response_cache.set(key, version, response)
+            return response
+        return wrapper
+    return decorator
+
+
 def table_list():
     return sa_common.table_list(db.engine)
 
@@ -136,15 +185,11 @@ def table_view_list():
     return sa_common.table_view_list(db.engine)
 
 
-codes_data = {}
-for table in table_list():
-    if table.startswith('c_'):
-        codes = {}
-        sql = 'SELECT code, "desc" FROM "{table}"'.format(table=table)
-        result = run_sql(sql)
-        for row in result:
-            codes[row[0]] = row[1]
-        codes_data[table[2:]] = codes
+code_cache = CodeCache(
+    run_sql,
+    check_interval=config.CODE_CACHE_CHECK_INTERVAL,
+    path=config.CODE_CACHE_PATH,
+)
 
 
 def auto_links(fields):
@@ -163,31 +208,121 @@ def auto_functions(fields):
     return functions
 
 
-def show_result(sql, table=None, data=None):
-    offset = int(request.args.get('offset', 0))
-    # We need to have a result to get the field types
-    if data is None:
-        data = {}
-    result = run_sql(sql + ' LIMIT 1', data)
+# rows shown on each page of results
+PAGE_SIZE = 1000
+
+# unique ordering for paging views, tables use their primary key
+TABLE_KEYS = {
+    'vao_list': ['id'],
+}
+
+
+def json_key_value(value):
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    return unicode(value)
+
+
+def keyset_sql(sql, keys, after=None):
+    ''' Returns (sql, params) to fetch the page of sql following the row
+    whose keys are after, a json list as made for next_after.  Raises
+    ValueError if after is not a list of a value for each key. '''
+    names = ['_key%s' % i for i in range(len(keys))]
+    sql = sql.format(keys=''.join(
+        [', %s AS %s' % (key, name) for key, name in zip(keys, names)]
+    ))
+    params = {}
+    where = ''
+    if after:
+        values = json.loads(after)
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError('after needs %s values' % len(keys))
+        for name, value in zip(names, values):
+            if isinstance(value, (list, dict)):
+                raise ValueError('after values must be scalars')
+            params['_after%s' % name] = value
+        where = 'WHERE ({keys}) > ({values})'.format(
+            keys=', '.join(['q.%s' % name for name in names]),
+            values=', '.join([':_after%s' % name for name in names]),
+        )
+    sql = 'SELECT * FROM (\n{sql}\n) AS q {where}\n' \
+        'ORDER BY {keys} LIMIT {limit}'.format(
+            sql=sql,
+            where=where,
+            keys=', '.join(['q.%s' % name for name in names]),
+            limit=PAGE_SIZE,
+        )
+    return sql, params
+
+
+def show_result(sql, table=None, data=None, keys=None):
+    ''' Run sql for a page of results.
+
+    With keys, a list of expressions giving a unique ordering, pages are
+    found by seeking past the keys of the previous page so that deep pages
+    cost the same as the first.  The sql must then have no ORDER BY and
+    contain {keys} at the end of its select list. '''
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    data = dict(data or {})
+    after = request.args.get('after')
+    if keys:
+        try:
+            sql, params = keyset_sql(sql, keys, after)
+        except ValueError:
+            abort(400)
+        data.update(params)
+    else:
+        sql += ' LIMIT %s OFFSET %s' % (PAGE_SIZE, offset)
+    # field types come from the same cursor as the data
+    try:
+        result = run_sql(sql, data)
+    except sa.exc.DataError:
+        # an after value that cannot be compared with its key
+        if not (keys and after):
+            raise
+        abort(400)
     fields = sa_common.get_result_fields(db.engine, result, table)
-    # Now run query
-    result = run_sql(sql + (' LIMIT 1000 OFFSET %s' % offset), data)
     output = {
         'fields': fields,
         'data': result,
         'offset': offset,
+        'page_size': PAGE_SIZE,
     }
+    if keys:
+        # drop the key columns but remember where the page ended
+        width = len(fields) - len(keys)
+        rows = result.fetchall()
+        output['fields'] = fields[:width]
+        output['data'] = [row[:width] for row in rows]
+        output['keyset'] = True
+        output['after'] = after
+        if len(rows) == PAGE_SIZE:
+            output['next_after'] = json.dumps(
+                [json_key_value(value) for value in rows[-1][width:]]
+            )
     if 'raw' not in request.args:
-        output['links'] = auto_links(fields)
-        output['functions'] = auto_functions(fields)
+        output['links'] = auto_links(output['fields'])
+        output['functions'] = auto_functions(output['fields'])
     return output
 
 
 def show_table(table):
+    keys = TABLE_KEYS.get(table) or get_primary_keys(table)
+    if keys:
+        sql = 'SELECT *{keys} FROM "%s"' % table
+        return show_result(sql, table, keys=['"%s"' % key for key in keys])
     sql = 'SELECT * FROM "%s"' % table
     return show_result(sql, table)
 
 
+@app.route('/cache/')
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+
 @app.route('/')
 def home():
     return render_template('home.html')
@@ -239,15 +374,16 @@ def la_list():
 def la_premises_list(la_code):
     data = {'la_code': la_code}
     sql = '''
-    SELECT v.uarn, b.uarn, s.code as scat_code
+    SELECT v.uarn, b.uarn, s.code as scat_code{keys}
     FROM vao_list v
     LEFT OUTER JOIN vao_base b
     ON b.uarn = v.uarn
     LEFT JOIN c_scat s ON s.code = v.scat_code
     WHERE v.la_code = :la_code
-    ORDER BY s.desc
     '''
-    output = show_result(sql, data=data)
+    # ORDER BY s.desc NULLS LAST, v.id
+    keys = ['s.desc IS NULL', "coalesce(s.desc, '')", 'v.id']
+    output = show_result(sql, data=data, keys=keys)
     del output['links'][1]
     output['functions'][1] = (add_yes,)
     output['fields'][1]['name'] = 'summary'
@@ -265,6 +401,7 @@ def la_sum_list():
     return render_template('table_output.html', data=output)
 
 @app.route('/la_sum/<la_code>')
+@cached('v_la_general_summary')
 def la_sum_report(la_code):
     data = {'la_code': la_code}
     sql = '''
@@ -289,6 +426,7 @@ def la_ct_list():
     return render_template('table_output.html', data=output)
 
 @app.route('/la_ct/<la_code>')
+@cached('s_la_spending_by_ct', 's_nuts1_spending_by_ct_group', 'c_ct')
 def la_ct_report(la_code):
     data = {'la_code': la_code}
     sql = '''
@@ -349,6 +487,7 @@ def la_areas_list():
 
 
 @app.route('/la_areas/<la_code>')
+@cached('s_vao_area_la_by_scat')
 def la_areas(la_code):
     data = {'la_code': la_code}
     sql = '''
@@ -397,6 +536,7 @@ def scat_areas_list():
 
 
 @app.route('/scat_areas/<scat_code>')
+@cached('s_vao_area_la_by_scat', 'c_la')
 def scat_areas(scat_code):
     data = {'scat_code': scat_code}
     sql = '''
@@ -441,8 +581,9 @@ def spending_nuts1_list():
 
 
 @app.route('/spending_nuts1/<nuts1>')
+@cached('c_ct', 's_consumer_spend_by_nuts1')
 def spending_nuts1(nuts1):
-    nuts1_desc = codes_data.get('nuts1').get(nuts1)
+    nuts1_desc = (code_cache.get('nuts1') or {}).get(nuts1)
     if not nuts1_desc:
         abort(404)
     sql = '''
@@ -463,38 +604,116 @@ def spending_nuts1(nuts1):
     )
 
 
-@app.route('/premises/<uarn>')
-def premises(uarn):
-    data = {'uarn': uarn}
-    output = []
+PREMISES_TABLES = [
+    'vao_list',
+    's_vao_premises_area',
+    'v_premises_summary',
+    'v_premises_summary2',
+    'vao_base',
+    'vao_line',
+    'vao_additions',
+    'vao_plant',
+    'vao_parking',
+    'vao_adj',
+    'vao_adj_totals',
+]
+
+PREMISES_SINGLE_ROW_TABLES = [
+    'vao_list',
+    'vao_base',
+    'v_premises_summary',
+    'v_premises_summary2',
+]
+
+
+# version of PREMISES_TABLES the catalog was loaded for, the catalog is
+# shared by the server threads so it is only used while holding the lock
+catalog_version = None
+catalog_lock = threading.Lock()
+
+
+def premises_fields():
+    ''' Returns list of (table, fields) of the premises tables that exist.
+    They come from the catalog, reloaded once any of the tables has been
+    updated. '''
+    global catalog_version
+    version = tuple(
+        run_sql(tables_version_sql, tables=PREMISES_TABLES).first()
+    )
+    with catalog_lock:
+        if version != catalog_version:
+            catalog.invalidate()
+            catalog_version = version
+        existing = set(catalog.table_view_list())
+        return [(table, catalog.get_fields(table))
+                for table in PREMISES_TABLES if table in existing]
+
+
+def json_value(value, field_type):
+    ''' Convert a value read from json_agg to what psycopg2 returns for the
+    column, json has no dates and its numbers are read as Decimal '''
+    if value is None:
+        return None
+    try:
+        if field_type == 'date':
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        if field_type == 'timestamp':
+            if '.' in value:
+                format_ = '%Y-%m-%dT%H:%M:%S.%f'
+            else:
+                format_ = '%Y-%m-%dT%H:%M:%S'
+            return datetime.datetime.strptime(value, format_)
+    except ValueError:
+        # infinity
+        return value
+    if field_type in ['float', 'real']:
+        return float(value)
+    return value
 
-    tables = [
-        'vao_list',
-        's_vao_premises_area',
-        'v_premises_summary',
-        'v_premises_summary2',
-        'vao_base',
-        'vao_line',
-        'vao_additions',
-        'vao_plant',
-        'vao_parking',
-        'vao_adj',
-        'vao_adj_totals',
-    ]
 
-    single_row_tables = [
-        'vao_list',
-        'vao_base',
-        'v_premises_summary',
-        'v_premises_summary2',
+def premises_sections(uarn):
+    ''' Returns (table, fields, rows) for each of the premises tables.
+
+    The rows of every table are fetched in one query, each as a json array
+    of row objects, and the fields come from the catalog. '''
+    tables = premises_fields()
+    sql = [
+        '''
+        SELECT {index}, (
+            SELECT json_agg(t)::text
+            FROM (SELECT * FROM "{table}" WHERE uarn = :uarn) t
+        )
+        '''.format(index=index, table=table)
+        for index, (table, fields) in enumerate(tables)
     ]
+    results = dict(run_sql('\nUNION ALL\n'.join(sql), uarn=uarn))
+    sections = []
+    for index, (table, fields) in enumerate(tables):
+        rows = []
+        if results.get(index):
+            for item in json.loads(results[index], parse_float=Decimal):
+                rows.append([
+                    json_value(item.get(field['name']), field['type'])
+                    for field in fields
+                ])
+        sections.append((table, fields, rows))
+    return sections
 
-    for table in tables:
-        sql = 'SELECT * FROM %s WHERE uarn = :uarn' % table
-        out = show_result(sql, table, data=data)
-        out['offset'] = ''
-        out['title'] = table
-        output.append((out, table in single_row_tables))
+
+@app.route('/premises/<uarn>')
+def premises(uarn):
+    output = []
+    for table, fields, rows in premises_sections(uarn):
+        out = {
+            'fields': fields,
+            'data': rows,
+            'offset': '',
+            'title': table,
+        }
+        if 'raw' not in request.args:
+            out['links'] = auto_links(fields)
+            out['functions'] = auto_functions(fields)
+        output.append((out, table in PREMISES_SINGLE_ROW_TABLES))
 
     return render_template('premises.html', output=output)
 
@@ -536,7 +755,7 @@ def ba_ref_premises():
         if uarn:
             return redirect(url_for('premises', uarn=uarn))
 
-    codes = codes_data.get('ba')
+    codes = code_cache.get('ba') or {}
     ba_codes = []
     for k, v in codes.iteritems():
         ba_codes.append((v, k))
@@ -587,6 +806,13 @@ def postcode_premises():
 
 
 @app.route('/scat_group_area_graph/')
+@cached(
+    'c_scat_group',
+    'c_scat',
+    's_vao_scat_group_median_areas',
+    's_vao_scat_median_areas',
+    's_vao_base_areas_scat_group',
+)
 def scat_group_area_graph():
     output = {}
 
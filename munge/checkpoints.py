@@ -0,0 +1,81 @@
+import datetime
+
+import sa_util
+
+
+TABLE = 'import_checkpoints'
+
+table_fields = [
+    '*name',
+    'target',
+    'spec',
+    'line:bigint',
+    'rows:bigint',
+    'errors:bigint',
+    'updated:timestamp',
+]
+
+_initiated = False
+
+
+def _init():
+    sa_util.ensure_table(TABLE, sa_util.process_header(table_fields))
+    global _initiated
+    _initiated = True
+
+
+def save_checkpoint(name, target, spec, line, rows, errors=0):
+    ''' Record that the rows up to line of the source for import name have
+    been committed to the target table '''
+    if not _initiated:
+        _init()
+    clear_checkpoint(name)
+    sql = '''
+        INSERT INTO {table} (name, target, spec, line, rows, errors, updated)
+        VALUES (:name, :target, :spec, :line, :rows, :errors, :updated)
+    '''.format(table=sa_util.quote(TABLE))
+    sa_util.run_sql(
+        sql,
+        name=name,
+        target=target,
+        spec=spec,
+        line=line,
+        rows=rows,
+        errors=errors,
+        updated=datetime.datetime.now(),
+    )
+
+
+def clear_checkpoint(name):
+    if not _initiated and TABLE not in sa_util.table_list():
+        return
+    sql = 'DELETE FROM {table} WHERE name = :name'.format(
+        table=sa_util.quote(TABLE)
+    )
+    sa_util.run_sql(sql, name=name)
+
+
+def get_checkpoint(name, spec):
+    ''' Returns the checkpoint for import name as a dict if it can be
+    resumed, the field spec must be unchanged and the target table must
+    still hold exactly the rows that were checkpointed '''
+    if TABLE not in sa_util.table_list():
+        return None
+    sql = '''
+        SELECT target, spec, line, rows, errors FROM {table}
+        WHERE name = :name
+    '''.format(table=sa_util.quote(TABLE))
+    checkpoint = None
+    for row in sa_util.run_sql(sql, name=name):
+        checkpoint = dict(zip(['target', 'spec', 'line', 'rows', 'errors'],
+                              row))
+    if not checkpoint or checkpoint['spec'] != spec:
+        return None
+    if checkpoint['target'] not in sa_util.table_list():
+        return None
+    sql = 'SELECT count(*) FROM {table}'.format(
+        table=sa_util.quote(checkpoint['target'])
+    )
+    if sa_util.run_sql(sql).scalar() != checkpoint['rows']:
+        return None
+    return checkpoint
@@ -10,6 +10,8 @@ import csv_util
 def import_module(args):
     from dependencies import dependencies_manager
     tables = []
+    if args.resume:
+        config.RESUME_IMPORTS = True
     for module in args.module:
         if not args.updateonly:
             definitions.get_importer(module)(verbose=args.verbose)
@@ -19,6 +21,8 @@ def import_module(args):
         sa_util.build_views_and_summaries(
             items=deps,
             verbose=args.verbose,
+            workers=args.workers,
+            incremental=False if args.rebuild else None,
         )
 
 
@@ -29,6 +33,8 @@ def build_views_summaries(args):
         verbose=args.verbose,
         force=args.force,
         dependencies=not args.no_dependants,
+        workers=args.workers,
+        incremental=False if args.rebuild else None,
     )
 
 
@@ -185,6 +191,9 @@ def main():
         module_parser.add_argument('-n', '--noupdate', action="store_true")
         module_parser.add_argument('-u', '--updateonly', action="store_true")
         module_parser.add_argument('-s', '--stage', default=0, type=int)
+        module_parser.add_argument('-j', '--workers', default=None, type=int)
+        module_parser.add_argument('-r', '--rebuild', action="store_true")
+        module_parser.add_argument('--resume', action="store_true")
         module_parser.add_argument('module', nargs='*')
 
     dep_parser = subparsers.add_parser('deps')
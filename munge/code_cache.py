@@ -0,0 +1,103 @@
+import cPickle as pickle
+import glob
+import os
+import os.path
+import threading
+import time
+
+import sqlalchemy as sa
+
+
+class CodeCache(object):
+    ''' Descriptions of the codes in the c_* tables.
+
+    Each table is loaded the first time its codes are asked for and is
+    reloaded once its table_summaries entry has been updated, the entries
+    are checked at most every check_interval seconds.
+
+    With a path the tables are also saved there, keyed on their update
+    time, so other processes can read them instead of querying the table.
+
+    It is shared by the threads of a web server process so the entries are
+    only changed while holding the lock.
+    '''
+
+    versions_sql = '''
+        SELECT name, updated FROM table_summaries
+        WHERE left(name, 2) = 'c_'
+    '''
+
+    def __init__(self, run_sql, check_interval=60, path=None):
+        self.run_sql = run_sql
+        self.check_interval = check_interval
+        self.path = path
+        self.checked = None
+        self.versions = {}
+        self.codes = {}
+        self.lock = threading.Lock()
+
+    def check(self):
+        if self.checked and time.time() - self.checked < self.check_interval:
+            return
+        self.versions = dict(self.run_sql(self.versions_sql))
+        self.checked = time.time()
+
+    def get(self, code_type):
+        ''' Returns dict of code: description or None if there is no
+        c_<code_type> table '''
+        with self.lock:
+            self.check()
+            table = 'c_' + code_type
+            version = self.versions.get(table)
+            if version is None:
+                return None
+            cached = self.codes.get(table)
+            if cached is None or cached[0] != version:
+                cached = (version, self.load(table, version))
+                self.codes[table] = cached
+            return cached[1]
+
+    def filename(self, table, version):
+        return os.path.join(self.path, '%s-%s.pickle' % (
+            table, version.strftime('%Y%m%d%H%M%S%f')
+        ))
+
+    def load(self, table, version):
+        if self.path:
+            filename = self.filename(table, version)
+            if os.path.exists(filename):
+                with open(filename, 'rb') as f:
+                    return pickle.load(f)
+        sql = 'SELECT code, "desc" FROM "{table}"'.format(table=table)
+        try:
+            codes = dict(self.run_sql(sql))
+        except sa.exc.DBAPIError:
+            # the table has been dropped but is still in table_summaries
+            return {}
+        if self.path:
+            self.save(table, version, codes)
+        return codes
+
+    def save(self, table, version, codes):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # made by another process
+                if not os.path.isdir(self.path):
+                    raise
+        filename = self.filename(table, version)
+        # write then rename so readers never see a partial file
+        temp = '%s.%s' % (filename, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(codes, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, filename)
+        # only remove older versions, another process may have saved a
+        # newer one.  The names sort by version.
+        for old in glob.glob(os.path.join(self.path, '%s-*.pickle' % table)):
+            if old < filename:
+                try:
+                    os.remove(old)
+                except OSError:
+                    # removed by another process
+                    pass
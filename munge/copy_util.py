@@ -0,0 +1,242 @@
+import datetime
+import struct
+from cStringIO import StringIO
+from decimal import Decimal
+
+import psycopg2.extensions
+
+import config
+import sa_util
+
+
+LOAD_MODES = ['insert', 'copy', 'copy_binary']
+
+BINARY_SIGNATURE = 'PGCOPY\n\xff\r\n\x00'
+
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+PG_EPOCH_DATE = PG_EPOCH.date()
+
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+
+
+def get_load_mode(load_mode=None):
+    if load_mode is None:
+        load_mode = config.LOAD_MODE
+    if load_mode not in LOAD_MODES:
+        raise Exception('Unknown load mode `%s`' % load_mode)
+    return load_mode
+
+
+def copy_sql(table, columns, binary=False):
+    sql = 'COPY "{table}" ({columns}) FROM STDIN'
+    if binary:
+        sql += ' WITH (FORMAT binary)'
+    return sql.format(
+        table=table,
+        columns=', '.join(['"%s"' % c for c in columns]),
+    )
+
+
+# Text format
+
+def text_value(value, encoding='utf-8'):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, unicode):
+        value = value.encode(encoding)
+    elif isinstance(value, float):
+        value = repr(value)
+    elif not isinstance(value, str):
+        value = str(value)
+    return (value.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def text_buffer(rows, encoding='utf-8'):
+    buf = StringIO()
+    for row in rows:
+        buf.write('\t'.join([text_value(v, encoding) for v in row]))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+# Binary format
+
+def _binary_text(encoding):
+    def fn(value):
+        if isinstance(value, unicode):
+            return value.encode(encoding)
+        if not isinstance(value, str):
+            return str(value)
+        return value
+    return fn
+
+
+def _binary_bool(value):
+    if isinstance(value, basestring):
+        value = value.lower() in ['yes', 'true', 'y', 't', '1']
+    return struct.pack('>?', value)
+
+
+def _binary_date(value):
+    if isinstance(value, basestring):
+        value = datetime.datetime.strptime(value[:10], '%Y-%m-%d')
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return struct.pack('>i', (value - PG_EPOCH_DATE).days)
+
+
+def _binary_timestamp(value):
+    if isinstance(value, basestring):
+        value = datetime.datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    delta = value - PG_EPOCH
+    micro = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return struct.pack('>q', micro)
+
+
+def _binary_numeric(value):
+    value = Decimal(value)
+    if value.is_nan():
+        return struct.pack('>hhHH', 0, 0, NUMERIC_NAN, 0)
+    sign, digits, exp = value.as_tuple()
+    digits = ''.join([str(d) for d in digits])
+    if exp >= 0:
+        int_part = digits + '0' * exp
+        frac_part = ''
+    elif len(digits) > -exp:
+        int_part = digits[:exp]
+        frac_part = digits[exp:]
+    else:
+        int_part = ''
+        frac_part = '0' * (-exp - len(digits)) + digits
+    dscale = len(frac_part)
+    # align to base 10000 digits around the decimal point
+    int_part = '0' * (-len(int_part) % 4) + int_part
+    frac_part = frac_part + '0' * (-len(frac_part) % 4)
+    weight = len(int_part) // 4 - 1
+    both = int_part + frac_part
+    groups = [int(both[i:i + 4]) for i in xrange(0, len(both), 4)]
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    header = struct.pack(
+        '>hhHH',
+        len(groups),
+        weight,
+        NUMERIC_NEG if sign else NUMERIC_POS,
+        dscale,
+    )
+    return header + struct.pack('>%dh' % len(groups), *groups)
+
+
+def _pack(fmt, convert):
+    def fn(value):
+        return struct.pack(fmt, convert(value))
+    return fn
+
+
+BINARY_ENCODERS = {
+    'smallint': _pack('>h', int),
+    'integer': _pack('>i', int),
+    'int': _pack('>i', int),
+    'bigint': _pack('>q', int),
+    'float': _pack('>d', float),
+    'double precision': _pack('>d', float),
+    'boolean': _binary_bool,
+    'date': _binary_date,
+    'timestamp': _binary_timestamp,
+    'numeric': _binary_numeric,
+}
+
+
+def binary_encoders(types, encoding='utf-8'):
+    encoders = []
+    for type_ in types:
+        if type_ == 'text':
+            encoders.append(_binary_text(encoding))
+            continue
+        if type_ not in BINARY_ENCODERS:
+            raise Exception(
+                'Binary COPY does not support type `%s`' % type_
+            )
+        encoders.append(BINARY_ENCODERS[type_])
+    return encoders
+
+
+def binary_buffer(rows, encoders):
+    buf = StringIO()
+    # signature, flags, header extension length
+    buf.write(BINARY_SIGNATURE)
+    buf.write(struct.pack('>ii', 0, 0))
+    field_count = struct.pack('>h', len(encoders))
+    null = struct.pack('>i', -1)
+    for row in rows:
+        buf.write(field_count)
+        for value, encoder in zip(row, encoders):
+            if value is None:
+                buf.write(null)
+                continue
+            value = encoder(value)
+            buf.write(struct.pack('>i', len(value)))
+            buf.write(value)
+    buf.write(struct.pack('>h', -1))
+    buf.seek(0)
+    return buf
+
+
+def copy_rows(table, fields, rows, binary=False, checksum=None):
+    ''' COPY rows (sequences in `fields` order) into table.  If given
+    checksum, a hashlib object, is updated with the data sent. '''
+    columns = [field['name'] for field in fields]
+    connection = sa_util.engine.raw_connection()
+    try:
+        # text is sent in the client encoding as psycopg2 does for inserts
+        encoding = psycopg2.extensions.encodings[connection.encoding]
+        if binary:
+            encoders = binary_encoders([field['type'] for field in fields],
+                                       encoding)
+            try:
+                buf = binary_buffer(rows, encoders)
+            except (ValueError, TypeError, ArithmeticError, struct.error):
+                # a value the encoders cannot read, such as a date in
+                # another format, is left for the server to parse
+                binary = False
+        if not binary:
+            buf = text_buffer(rows, encoding)
+        if checksum:
+            checksum.update(buf.getvalue())
+        cursor = connection.cursor()
+        cursor.copy_expert(copy_sql(table, columns, binary=binary), buf)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def load_rows(table, fields, rows, load_mode=None, checksum=None):
+    ''' Write a batch of rows, sequences of values in insert_fields(fields)
+    order, to table using the given load mode.  If given checksum, a hashlib
+    object, is updated with the rows written. '''
+    load_mode = get_load_mode(load_mode)
+    fields = sa_util.insert_fields(fields)
+    if load_mode == 'insert':
+        names = [field['name'] for field in fields]
+        sa_util.run_sql(sa_util.insert_rows(table, fields),
+                        [dict(zip(names, row)) for row in rows])
+        if checksum:
+            checksum.update(repr(rows))
+        return
+    copy_rows(table, fields, rows, binary=(load_mode == 'copy_binary'),
+              checksum=checksum)
@@ -1,23 +1,31 @@
 import csv
+import hashlib
 import os.path
 import glob
 import re
 import collections
+import operator
 
 import config
 import import_fns
+import import_errors
+import checkpoints
 from sa_util import (
     run_sql,
     table_list,
     get_result_fields,
+    insert_fields,
     create_table,
-    insert_rows,
     build_indexes,
+    primary_key_fields,
+    set_logged,
     table_columns,
     fields_match,
     truncate_table,
 )
+from copy_util import load_rows, get_load_mode
 from common import process_header
+from workers import run_jobs, raise_errors
 from summeries import update_summary_table
 
 
@@ -53,6 +61,304 @@ def get_fns(fields):
     return fns
 
 
+class ConversionError(Exception):
+    ''' A row value could not be converted, field is None if the row
+    itself was malformed and error is the original exception '''
+
+    def __init__(self, field, error):
+        Exception.__init__(self, '%s: %s' % (field, error))
+        self.field = field
+        self.error = error
+
+
+def _conversion_step(fn, target, args):
+    ''' Return a function setting values[target] from fn applied to the
+    values at the args indexes, specialised for the common arities '''
+    if len(args) == 1:
+        a, = args
+
+        def step(values):
+            values[target] = fn(values[a])
+    elif len(args) == 2:
+        a, b = args
+
+        def step(values):
+            values[target] = fn(values[a], values[b])
+    else:
+        def step(values):
+            values[target] = fn(*[values[i] for i in args])
+    return step
+
+
+def row_converter(fields):
+    ''' Compile fields into a function converting a source row into a
+    tuple of values in insert_fields(fields) order.
+
+    Column positions and conversion arguments are resolved here once so
+    each row only needs list indexing and the conversion calls. '''
+    names = [field['name'] for field in fields if not field.get('missing')]
+    width = len(names)
+    slots = {}
+    for i, name in enumerate(names):
+        slots[name] = i
+    # fields not supplied in the data get slots after the source values
+    for field in fields:
+        if field['name'] not in slots:
+            slots[field['name']] = len(slots)
+    padding = [None] * (len(slots) - width)
+
+    steps = []
+    for name, (fn, fn_field) in get_fns(fields).items():
+        if fn_field:
+            args = [slots[x] for x in fn_field.split('|')]
+        else:
+            args = [slots[name]]
+        step = _conversion_step(fn, slots[name], args)
+        steps.append((name, step))
+
+    out = [slots[field['name']] for field in insert_fields(fields)]
+    if len(out) == 1:
+        index, = out
+
+        def output(values):
+            return (values[index],)
+    else:
+        output = operator.itemgetter(*out)
+
+    def convert(row):
+        values = list(row)
+        if len(values) != width:
+            if len(values) < width:
+                raise ConversionError(None, IndexError(
+                    'Row has %s values, expected %s' % (len(values), width)
+                ))
+            del values[width:]
+        values.extend(padding)
+        for name, step in steps:
+            try:
+                step(values)
+            except Exception as e:
+                raise ConversionError(name, e)
+        return output(values)
+    return convert
+
+
+class TableLoader(object):
+    ''' Converts rows and loads them into a temp table in batches '''
+
+    def __init__(self,
+                 table_name,
+                 t_fields,
+                 description=None,
+                 verbose=0,
+                 limit=None,
+                 keep_table=False,
+                 importer=None,
+                 load_mode=None,
+                 resume=None):
+        self.table_name = table_name
+        self.t_fields = t_fields
+        self.description = description
+        self.verbose = verbose
+        self.limit = limit
+        self.importer = importer
+        self.load_mode = get_load_mode(load_mode)
+        self.temp_table = config.TEMP_TABLE_STR + table_name
+        self.count = 0
+        self.lines = 0
+        self.data = []
+        # bad rows waiting to be saved and the number per field
+        self.errors = []
+        self.error_count = 0
+        self.field_errors = collections.Counter()
+        self.errors_cleared = False
+        # last source line added and the lines a resumed load skips
+        self.line = 0
+        self.resume_line = 0
+        self.resumed = False
+        # fingerprint of the field spec and the rows written, updated with
+        # each batch as it is loaded
+        self.checksum = hashlib.md5(
+            repr([sorted(field.items()) for field in t_fields])
+        )
+        self.spec = self.checksum.hexdigest()
+
+        if resume is None:
+            resume = config.RESUME_IMPORTS
+        checkpoint = None
+        if resume:
+            checkpoint = checkpoints.get_checkpoint(table_name, self.spec)
+        if checkpoint:
+            self.resume(checkpoint)
+            keep_table = self.temp_table == table_name
+        else:
+            checkpoints.clear_checkpoint(table_name)
+            if keep_table and table_name not in table_list():
+                keep_table = False
+            if keep_table:
+                old_fields = table_columns(table_name)
+                if fields_match(old_fields, t_fields):
+                    truncate_table(table_name, verbose=verbose)
+                    self.temp_table = table_name
+                else:
+                    keep_table = False
+            if not keep_table:
+                create_table(self.temp_table, t_fields, verbose=verbose,
+                             defer_pk=config.DEFER_PRIMARY_KEYS,
+                             unlogged=config.UNLOGGED_STAGING)
+        self.keep_table = keep_table
+
+        import_fns.prewarm([field['fn'] for field in t_fields
+                            if field.get('fn')])
+        self.convert = row_converter(t_fields)
+
+    def resume(self, checkpoint):
+        ''' Carry on loading into the table of an interrupted import '''
+        self.temp_table = checkpoint['target']
+        self.resume_line = checkpoint['line']
+        self.resumed = True
+        self.count = checkpoint['rows']
+        self.error_count = checkpoint['errors']
+        # errors after the checkpoint will be found again
+        import_errors.clear_errors(self.table_name,
+                                   after_line=self.resume_line)
+        self.errors_cleared = True
+        if self.verbose:
+            print('{table}: resuming after line {line:,}, '
+                  '{count:,} rows loaded'.format(
+                      table=self.table_name,
+                      line=self.resume_line,
+                      count=self.count,
+                  ))
+
+    def add(self, row, line=None):
+        ''' Convert and store row, returns False once limit is reached.
+        line is the position of row in the source, if not given rows are
+        numbered in the order they are added. '''
+        self.lines += 1
+        if line is None:
+            line = self.lines
+        self.line = line
+        if line <= self.resume_line:
+            # already loaded before the import was interrupted
+            return True
+        try:
+            values = self.convert(row)
+        except ConversionError as e:
+            values = None
+            self.add_error(line, e.field, e.error, row)
+        if values is not None:
+            self.data.append(values)
+            self.count += 1
+        if len(self.data) >= config.BATCH_SIZE:
+            self.flush()
+            if self.verbose:
+                print('{table}: {count:,}'.format(
+                    table=self.table_name, count=self.count
+                ))
+        if self.limit and self.count == self.limit:
+            return False
+        return True
+
+    def add_error(self, line, field, error, row):
+        self.errors.append((line, field, error, list(row)))
+        self.error_count += 1
+        self.field_errors[field] += 1
+        if len(self.errors) >= config.BATCH_SIZE:
+            self.save_errors()
+        self.check_errors()
+
+    def check_errors(self):
+        ''' Abort the load once there are too many bad rows '''
+        limit = config.MAX_IMPORT_ERRORS
+        percent = config.MAX_IMPORT_ERROR_PERCENT
+        too_many = limit is not None and self.error_count > limit
+        # percentages are only meaningful after a reasonable sample
+        if (percent is not None and self.lines >= config.BATCH_SIZE and
+                self.error_count * 100.0 / self.lines > percent):
+            too_many = True
+        if too_many:
+            self.save_errors()
+            self.print_errors()
+            raise Exception(
+                'Import of {table} aborted: {errors:,} bad rows in '
+                '{lines:,}, see {errors_table}'.format(
+                    table=self.table_name,
+                    errors=self.error_count,
+                    lines=self.lines,
+                    errors_table=import_errors.TABLE,
+                )
+            )
+
+    def save_errors(self):
+        if not self.errors_cleared:
+            import_errors.clear_errors(self.table_name)
+            self.errors_cleared = True
+        if self.errors:
+            import_errors.save_errors(self.table_name, self.errors)
+            self.errors = []
+
+    def print_errors(self):
+        if not self.error_count:
+            return
+        print('{table}: {count:,} bad rows'.format(
+            table=self.table_name, count=self.error_count
+        ))
+        for field, count in self.field_errors.most_common():
+            print('\t{field}: {count:,}'.format(
+                field=field or '(row)', count=count
+            ))
+
+    def flush(self):
+        if self.data:
+            load_rows(self.temp_table, self.t_fields, self.data,
+                      self.load_mode, checksum=self.checksum)
+            self.data = []
+            self.save_errors()
+            self.checkpoint()
+
+    def checkpoint(self):
+        ''' Record how far through the source the committed rows go so an
+        interrupted import can be resumed '''
+        checkpoints.save_checkpoint(self.table_name,
+                                    self.temp_table,
+                                    self.spec,
+                                    self.line,
+                                    self.count,
+                                    self.error_count)
+
+    def close(self):
+        self.flush()
+        self.save_errors()
+        self.print_errors()
+        if self.verbose:
+            print('{table}: {count:,} rows imported'.format(
+                table=self.table_name, count=self.count
+            ))
+        if not self.keep_table:
+            if config.UNLOGGED_STAGING:
+                set_logged(self.temp_table, verbose=self.verbose)
+            # Add indexes
+            build_indexes(self.temp_table, self.t_fields,
+                          verbose=self.verbose,
+                          primary_key=primary_key_fields(self.t_fields))
+        # the fingerprint is of the data written so that changes to
+        # converters or lookup tables are seen by the dependant builds.  The
+        # rows loaded before a resume were not seen so there is none.
+        fingerprint = None
+        if not self.resumed:
+            fingerprint = 'rows:%s:errors:%s:md5:%s' % (
+                self.count, self.error_count, self.checksum.hexdigest()
+            )
+        update_summary_table(self.table_name,
+                             self.description,
+                             importer=self.importer,
+                             created=not self.keep_table,
+                             fingerprint=fingerprint)
+        checkpoints.clear_checkpoint(self.table_name)
+        import_fns.clear_lookups(self.table_name)
+
+
 def import_csv(reader,
                table_name,
                fields=None,
@@ -61,88 +367,60 @@ def import_csv(reader,
                verbose=0,
                limit=None,
                keep_table=False,
-               importer=None):
-    if keep_table and table_name not in table_list():
-        keep_table = False
-    temp_table = config.TEMP_TABLE_STR + table_name
-    count = 0
-    t_fields = []
-    data = []
+               importer=None,
+               load_mode=None):
+    loader = None
     has_header_row = (fields is None) or skip_first
-    first = True
-    set_first = False
-    for row in reader:
-        skip = False
-        if first:
+    for line, row in enumerate(reader, 1):
+        if loader is None:
             if len(row) == 1 and row[0][:1] == '#':
                 if not description:
                     description = row[0][1:].strip()
-                skip = True
-            else:
-                if fields is None:
-                    fields = row
-                t_fields = process_header(fields)
-                t_fns = get_fns(t_fields)
-                if keep_table:
-                    old_fields = table_columns(table_name)
-                    if fields_match(old_fields, t_fields):
-                        truncate_table(table_name, verbose=verbose)
-                        temp_table = table_name
-                    else:
-                        keep_table = False
-                if not keep_table:
-                    create_table(temp_table, t_fields, verbose=verbose)
-                f = [
-                    field['name'] for field in t_fields
-                    if not field.get('missing')
-                ]
-                insert_sql = insert_rows(temp_table, t_fields)
-                set_first = True
-        if not ((description or has_header_row) and first):
-            row_data = dict(zip(f, row))
-            for fn in t_fns:
-                fn_info = t_fns[fn]
-                if fn_info[1]:
-                    fn_fields = fn_info[1].split('|')
-                else:
-                    fn_fields = [fn]
-                try:
-                    row_data[fn] = fn_info[0](*[row_data[x] for x in fn_fields])
-                except Exception as e:
-                    # FIXME log error
-                    print(str(e))
-                    print(fn)
-                    print(row_data)
-                    skip = True
-            if not skip:
-                data.append(row_data)
-            if count % config.BATCH_SIZE == 0 and count:
-                run_sql(insert_sql, data)
-                data = []
-                if verbose:
-                    print('{table}: {count:,}'.format(
-                        table=table_name, count=count
-                    ))
-            if not skip:
-                count += 1
-            if limit and count == limit:
-                break
-        if set_first:
-            first = False
-    if data:
-        run_sql(insert_sql, data)
-
-    if verbose:
-        print('{table}: {count:,} rows imported'.format(
-            table=table_name, count=count
-        ))
-    # Add indexes
-    if not keep_table:
-        build_indexes(temp_table, t_fields, verbose=verbose)
-    update_summary_table(table_name,
-                         description,
-                         importer=importer,
-                         created=not keep_table)
+                continue
+            if fields is None:
+                fields = row
+            loader = TableLoader(table_name,
+                                 process_header(fields),
+                                 description=description,
+                                 verbose=verbose,
+                                 limit=limit,
+                                 keep_table=keep_table,
+                                 importer=importer,
+                                 load_mode=load_mode)
+            if description or has_header_row:
+                continue
+        if not loader.add(row, line):
+            break
+    if loader:
+        loader.close()
+
+
+def import_demux(reader,
+                 tables,
+                 verbose=0,
+                 importer=None,
+                 load_mode=None):
+    ''' Load several tables from a single pass over reader.
+
+    reader yields (key, row) pairs and tables is a list of
+    (key, table_name, fields), each row is routed to the loader for its key
+    and rows with unknown keys are ignored.
+    '''
+    loaders = {}
+    for key, table_name, fields in tables:
+        if verbose:
+            print('importing %s' % table_name)
+        loaders[key] = TableLoader(table_name,
+                                   process_header(fields),
+                                   verbose=verbose,
+                                   importer=importer,
+                                   load_mode=load_mode)
+    for line, (key, row) in enumerate(reader, 1):
+        loader = loaders.get(key)
+        if loader:
+            loader.add(row, line)
+    for key, table_name, fields in tables:
+        loaders[key].close()
 
 
 def import_single(filename,
@@ -150,6 +428,7 @@ def import_single(filename,
                   verbose=0,
                   importer=None,
                   keep_table=False,
+                  load_mode=None,
                   **kw):
     if verbose:
         print('importing %s' % table_name)
@@ -158,7 +437,8 @@ def import_single(filename,
                table_name,
                verbose=verbose,
                importer=importer,
-               keep_table=keep_table)
+               keep_table=keep_table,
+               load_mode=load_mode)
 
 
 def get_csv_files(directory):
@@ -173,14 +453,19 @@ def csv_table_list(directory):
     return [table_name_from_path(f) for f in get_csv_files(directory)]
 
 
-def import_all(directory, verbose=0, keep_table=False, importer=None):
+def import_all(directory, verbose=0, keep_table=False, importer=None,
+               load_mode=None, workers=None):
+    jobs = []
     for f in get_csv_files(directory):
         table_name = table_name_from_path(f)
-        import_single(f,
-                      table_name,
-                      verbose=verbose,
-                      importer=importer,
-                      keep_table=keep_table)
+        kw = {
+            'verbose': verbose,
+            'importer': importer,
+            'keep_table': keep_table,
+            'load_mode': load_mode,
+        }
+        jobs.append((table_name, import_single, [f, table_name], kw))
+    raise_errors(run_jobs(jobs, workers=workers, verbose=verbose))
 
 
 def make_headers(result, table_name, simple=False):
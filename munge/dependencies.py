@@ -1,25 +1,70 @@
+import heapq
+
 from definitions import defined_tables, defined_dependencies
 
 
+def direct_dependants(deps):
+    ''' Returns dict of item: items that depend on it directly, every item
+    in deps is included '''
+    dependants = {}
+    for k, v in deps.items():
+        dependants.setdefault(k, set())
+        for i in v:
+            dependants.setdefault(i, set()).add(k)
+    return dependants
+
+
+def topological_sort(deps, dependants):
+    ''' Kahn's algorithm, ties are broken by name so the ordering is
+    stable between runs '''
+    waiting = {}
+    for item in dependants:
+        waiting[item] = len(deps.get(item, []))
+    ready = [item for item, count in waiting.items() if count == 0]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        item = heapq.heappop(ready)
+        ordered.append(item)
+        for dependant in dependants[item]:
+            waiting[dependant] -= 1
+            if waiting[dependant] == 0:
+                heapq.heappush(ready, dependant)
+    if len(ordered) != len(dependants):
+        raise Exception(
+            'Dependency cycle: %s' % ' -> '.join(
+                find_cycle(deps, set(dependants) - set(ordered))
+            )
+        )
+    return ordered
+
+
+def find_cycle(deps, items):
+    ''' Return a cycle from items, all of which are in or behind one '''
+    item = min(items)
+    path = []
+    seen = {}
+    while item not in seen:
+        seen[item] = len(path)
+        path.append(item)
+        item = min(d for d in deps[item] if d in items)
+    return path[seen[item]:] + [item]
+
+
 class DependenciesManager(object):
+    ''' Dependency graph of the defined views and summaries.
+
+    deps_ordered is a topological ordering, every item comes after all of
+    the items it depends on. deps_full maps each item to all of its direct
+    and indirect dependants. '''
 
     def __init__(self):
         self.get_dependencies()
 
     def sort_deps(self, deps):
-        def cmp(x, y):
-            try:
-                idx_x = self.deps_ordered.index(x)
-            except ValueError:
-                idx_x = -1
-            try:
-                idx_y = self.deps_ordered.index(y)
-            except ValueError:
-                idx_y = -1
-            return idx_x > idx_y
-        deps = list(deps)
-        deps.sort(cmp)
-        return deps
+        ''' Sort deps into build order, unknown items come first '''
+        rank = self.rank
+        return sorted(deps, key=lambda x: rank.get(x, -1))
 
     def get_needed_updates(self, item):
         return self.sort_deps(self.deps_full.get(item) or [])
@@ -29,54 +74,51 @@ class DependenciesManager(object):
         for item in items:
             if include:
                 updates.add(item)
-            updates |= set(self.get_needed_updates(item))
+            updates |= self.deps_full.get(item, set())
         updates = self.sort_deps(updates)
         return updates
 
-    def get_dependencies(self):
-
-        def cmp_dependency(x, y):
-            d = deps_full.get(y, [])
-            if x in d:
-                return True
-            return False
-
-        def sort_bubblesort(my_list):
-
-            for pos_upper in xrange(len(my_list) - 1, 0, -1):
-                for i in xrange(pos_upper):
-                    if cmp_dependency(my_list[i], my_list[i + 1]):
-                        my_list[i], my_list[i + 1] = my_list[i + 1], my_list[i]
-            return my_list
+    def dependencies_within(self, items):
+        ''' For each item the other items that must be built before it.
+        Dependencies on definitions not in items are followed through so
+        that ordering is kept. '''
+        deps = self.deps_all
+        items = set(items)
+        output = {}
+        for item in items:
+            found = set()
+            seen = set()
+            stack = list(deps.get(item, []))
+            while stack:
+                dep = stack.pop()
+                if dep in seen:
+                    continue
+                seen.add(dep)
+                if dep in items:
+                    found.add(dep)
+                else:
+                    stack.extend(deps.get(dep, []))
+            output[item] = found
+        return output
 
+    def get_dependencies(self):
         deps = defined_dependencies()
-        deps_partial = {}
-        for k, v in deps.items():
-            if k not in deps_partial:
-                deps_partial[k] = set()
-            for i in v:
-                if i not in deps_partial:
-                    deps_partial[i] = set()
-                deps_partial[i].add(k)
+        dependants = direct_dependants(deps)
+        deps_ordered = topological_sort(deps, dependants)
 
+        # transitive closure, dependants are always complete before the
+        # items they depend on when walking the ordering backwards
         deps_full = {}
-        for k, v in deps_partial.items():
-            deps_full[k] = set(v)
-            for i in v:
-                deps_full[k] |= deps_partial.get(i, set())
-
-        deps_full2 = {}
-        for k, v in deps_full.items():
-            deps_full2[k] = set(v)
-            for i in v:
-                deps_full2[k] |= deps_full.get(i, set())
-        deps_full = deps_full2
-        # make item list so we can order it
-        deps_ordered = list(deps_full)
-        # order dependencies list
-        sort_bubblesort(deps_ordered)
+        for item in reversed(deps_ordered):
+            full = set(dependants[item])
+            for i in dependants[item]:
+                full |= deps_full[i]
+            deps_full[item] = full
 
         self.deps_ordered = deps_ordered
+        self.rank = dict((item, i) for i, item in enumerate(deps_ordered))
         self.deps_full = deps_full
+        self.deps_all = defined_dependencies(disabled=True)
+
 
 dependencies_manager = DependenciesManager()
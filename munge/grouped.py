@@ -0,0 +1,62 @@
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class GroupedValues(object):
+    ''' Collects numeric values per group key for table functions.
+
+    Each column of each group is stored in a compact array of doubles (8
+    bytes a value) and statistics are computed a whole group at a time,
+    with numpy when it is installed.  None values are ignored. '''
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.groups = {}
+        self.rows = {}
+
+    def add(self, key, *values):
+        if key not in self.groups:
+            self.groups[key] = [array.array('d') for c in self.columns]
+            self.rows[key] = 0
+        self.rows[key] += 1
+        group = self.groups[key]
+        for i, value in enumerate(values):
+            if value is not None:
+                group[i].append(value)
+
+    def keys(self):
+        return sorted(self.groups.keys())
+
+    def values(self, key, column):
+        values = self.groups[key][self.columns.index(column)]
+        if numpy is not None:
+            return numpy.frombuffer(values, dtype=numpy.float64)
+        return values
+
+    def count(self, key, column=None):
+        ''' Number of values in column or rows added for the group '''
+        if column is None:
+            return self.rows[key]
+        return len(self.values(key, column))
+
+    def percentile(self, key, column, percent):
+        ''' Linear interpolation between the closest ranks, as numpy and
+        postgres percentile_cont do '''
+        values = self.values(key, column)
+        if not len(values):
+            return None
+        if numpy is not None:
+            return float(numpy.percentile(values, percent))
+        values = sorted(values)
+        position = (len(values) - 1) * percent / 100.0
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        fraction = position - lower
+        return values[lower] + (values[upper] - values[lower]) * fraction
+
+    def median(self, key, column):
+        return self.percentile(key, column, 50)
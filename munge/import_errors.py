@@ -0,0 +1,67 @@
+import datetime
+import json
+
+import sa_util
+from copy_util import load_rows
+
+
+TABLE = 'import_errors'
+
+table_fields = [
+    '+table_name',
+    'line:bigint',
+    'field',
+    'error_class',
+    'error',
+    'row',
+    'created:timestamp',
+]
+
+_initiated = False
+
+
+def _init():
+    sa_util.ensure_table(TABLE, sa_util.process_header(table_fields))
+    global _initiated
+    _initiated = True
+
+
+def clear_errors(table_name, after_line=None):
+    ''' Remove the errors recorded by a previous import of table_name, or
+    just those after a line when it is being resumed '''
+    if not _initiated and TABLE not in sa_util.table_list():
+        return
+    sql = 'DELETE FROM {table} WHERE table_name = :table_name'.format(
+        table=sa_util.quote(TABLE)
+    )
+    params = {'table_name': table_name}
+    if after_line is not None:
+        sql += ' AND line > :line'
+        params['line'] = after_line
+    sa_util.run_sql(sql, **params)
+
+
+def _message(e):
+    try:
+        return unicode(e)
+    except UnicodeDecodeError:
+        return str(e).decode('utf-8', 'replace')
+
+
+def save_errors(table_name, errors):
+    ''' Write a batch of (line, field, exception, row) to the errors table '''
+    if not _initiated:
+        _init()
+    created = datetime.datetime.now()
+    rows = []
+    for line, field, e, row in errors:
+        rows.append((
+            table_name,
+            line,
+            field,
+            e.__class__.__name__,
+            _message(e),
+            json.dumps(row),
+            created,
+        ))
+    load_rows(TABLE, sa_util.process_header(table_fields), rows)
@@ -15,9 +15,6 @@ AUTO_FNS = {
 }
 
 
-lookups = {}
-
-
 def make_bool(value):
     if value == '':
         return None
@@ -148,33 +145,77 @@ def ct_level_3(value):
         return int(s[2])
 
 
-def _translation_lookup(name, sql):
-    def fn(value):
-        if name not in lookups:
-            result = run_sql(sql)
-            l = {}
-            for row in result:
-                l[row[0]] = row[1]
-            lookups[name] = l
-        return lookups[name].get(value)
-    return fn
-
-# FIX ME MOVE INTO importer
-sql = 'SELECT la_sub_code, la_code FROM l_la_sub_la;'
-la_sub_2_la = _translation_lookup('la_sub_2_la', sql)
-
+class LookupTable(object):
+    ''' Translations from a key column of table to each of columns.
+
+    All the columns are read with a single query the first time any of
+    them is used.  Loading before worker processes are forked lets them
+    share the data rather than each querying it again. '''
+
+    def __init__(self, table, key, columns):
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.data = None
+
+    def load(self):
+        sql = 'SELECT "{key}", {columns} FROM "{table}";'.format(
+            key=self.key,
+            columns=', '.join(['"%s"' % c for c in self.columns]),
+            table=self.table,
+        )
+        data = dict((column, {}) for column in self.columns)
+        for row in run_sql(sql):
+            for column, value in zip(self.columns, row[1:]):
+                data[column][row[0]] = value
+        self.data = data
+
+    def clear(self):
+        self.data = None
+
+    def lookup(self, column):
+        def fn(value):
+            if self.data is None:
+                self.load()
+            return self.data[column].get(value)
+        fn.lookup_table = self
+        return fn
+
+
+def prewarm(fn_names=None):
+    ''' Load the lookup tables used by the named import functions, or all
+    of them, so that no queries are made while rows are converted '''
+    if fn_names is None:
+        fn_names = [
+            name for name, fn in globals().items()
+            if hasattr(fn, 'lookup_table')
+        ]
+    for name in fn_names:
+        table = getattr(globals().get(name), 'lookup_table', None)
+        if table and table.data is None:
+            table.load()
+
+
+def clear_lookups(table_name=None):
+    ''' Forget loaded lookup data eg after its source table is reloaded '''
+    for table in lookup_tables:
+        if table_name is None or table.table == table_name:
+            table.clear()
 
-sql = 'SELECT ba_code, la_code FROM l_ba_la;'
-ba_2_la = _translation_lookup('ba_2_la', sql)
 
-sql = 'SELECT la_code, nuts1_code FROM l_la_nuts;'
-la_sub_2_nuts1 = _translation_lookup('la_sub_2_nuts1', sql)
-
-sql = 'SELECT la_code, nuts2_code FROM l_la_nuts;'
-la_sub_2_nuts2 = _translation_lookup('la_sub_2_nuts2', sql)
-
-sql = 'SELECT la_code, nuts3_code FROM l_la_nuts;'
-la_sub_2_nuts3 = _translation_lookup('la_sub_2_nuts3', sql)
-
-sql = 'SELECT "desc", code FROM c_nuts3;'
-nuts3_from_name = _translation_lookup('nuts3_from_name', sql)
+# FIX ME MOVE INTO importer
+l_la_sub_la = LookupTable('l_la_sub_la', 'la_sub_code', ['la_code'])
+l_ba_la = LookupTable('l_ba_la', 'ba_code', ['la_code'])
+l_la_nuts = LookupTable(
+    'l_la_nuts', 'la_code', ['nuts1_code', 'nuts2_code', 'nuts3_code']
+)
+c_nuts3 = LookupTable('c_nuts3', 'desc', ['code'])
+
+lookup_tables = [l_la_sub_la, l_ba_la, l_la_nuts, c_nuts3]
+
+la_sub_2_la = l_la_sub_la.lookup('la_code')
+ba_2_la = l_ba_la.lookup('la_code')
+la_sub_2_nuts1 = l_la_nuts.lookup('nuts1_code')
+la_sub_2_nuts2 = l_la_nuts.lookup('nuts2_code')
+la_sub_2_nuts3 = l_la_nuts.lookup('nuts3_code')
+nuts3_from_name = c_nuts3.lookup('code')
@@ -9,6 +9,7 @@ DIRECTORY = 'pc'
 IMPORTER = 'postcode'
 FILENAME = 'ONSPD_MAY_2015_UK.csv'
 TABLE_NAME = 'postcode'
+LOAD_MODE = 'copy_binary'
 
 
 def tables():
@@ -91,4 +92,5 @@ def importer(verbose=0):
                    importer=IMPORTER,
                    description='Postcode data',
                    skip_first=True,
+                   load_mode=LOAD_MODE,
                    verbose=verbose)
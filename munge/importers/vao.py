@@ -2,8 +2,11 @@ import os.path
 from decimal import Decimal
 
 from munge import config
-from munge.csv_util import import_csv, unicode_csv_reader
+from munge.csv_util import import_csv, import_demux, unicode_csv_reader
 from munge.sa_util import results_dict, get_result_fields
+from munge.grouped import GroupedValues
+from munge.import_fns import prewarm
+from munge.workers import run_jobs, raise_errors
 
 DIRECTORY = 'vao'
 IMPORTER = 'vao'
@@ -312,24 +315,24 @@ def s_vao_premises_area(data, verbose=0):
 def s_vao_area(results, data, verbose=0):
     first = True
     count = 0
-    store = {}
+    store = GroupedValues(['m2', 'price_per_m2'])
+    singles = {}
     for row in results:
         if first:
             f = [field['name'] for field in get_result_fields(results)]
+            first = False
         row_data = dict(zip(f, row))
         key = row_data['scat_code']
         value = row_data['total_value']
         area = row_data['total_area']
-        if key not in store:
-            store[key] = [[], [], 0, 0]
-        if area:
-            store[key][1].append(area)
-        if area and value:
-            store[key][0].append(value/area)
+        store.add(
+            key,
+            float(area) if area else None,
+            float(value / area) if area and value else None,
+        )
         count += 1
-        store[key][3] += 1
         if area == 1:
-            store[key][2] += 1
+            singles[key] = singles.get(key, 0) + 1
         if verbose and count % config.BATCH_SIZE == 0:
                 print('processing {count:,}'.format(
                     count=count
@@ -338,36 +341,28 @@ def s_vao_area(results, data, verbose=0):
     if verbose:
         print('calculating...')
     out = [data['fields']]
-    for key in sorted(store.keys()):
+    for key in store.keys():
         if verbose:
             print('{key}  {c1:,}  {c2:,}'.format(
-                key=key, c1=len(store[key][0]), c2=len(store[key][1])
+                key=key,
+                c1=store.count(key, 'price_per_m2'),
+                c2=store.count(key, 'm2'),
             ))
         out.append(
             [
                 key,
-                median(store[key][0]),
-                median(store[key][1]),
-                len(store[key][0]),
-                len(store[key][1]),
-                store[key][2],
-                store[key][3],
+                store.median(key, 'm2'),
+                store.median(key, 'price_per_m2'),
+                store.count(key, 'm2'),
+                store.count(key, 'price_per_m2'),
+                singles.get(key, 0),
+                store.count(key),
             ]
         )
 
     return out
 
 
-def median(lst):
-    lst = sorted(lst)
-    if len(lst) < 1:
-            return None
-    if len(lst) %2 == 1:
-            return lst[((len(lst)+1)/2)-1]
-    else:
-            return float(sum(lst[(len(lst)/2)-1:(len(lst)/2)+1]))/2.0
-
-
 AUTO_SQL = [
     # Only rows with a rateable value are valid
     {
@@ -609,8 +604,8 @@ AUTO_SQL = [
             SELECT t1.outcode, t1.scat_code, count(*),
             sum(total_area) as total_m2,
             sum(total_value) as total_value,
-            usr_median(total_area) as median_m2,
-            usr_median(total_value/total_area) as median_price_per_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY total_area) as median_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY total_value/total_area) as median_price_per_m2,
             t2.median_price_per_m2 as national_price_per_m2
             FROM {t1} t1
             LEFT OUTER JOIN {t2} t2 on t1.scat_code = t2.scat_code
@@ -629,8 +624,8 @@ AUTO_SQL = [
             SELECT t1.areacode, t1.scat_code, count(*),
             sum(total_area) as total_m2,
             sum(total_value) as total_value,
-            usr_median(total_area) as median_m2,
-            usr_median(total_value/total_area) as median_price_per_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY total_area) as median_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY total_value/total_area) as median_price_per_m2,
             t2.median_price_per_m2 as national_price_per_m2
             FROM {t1} t1
             LEFT OUTER JOIN {t2} t2 on t1.scat_code = t2.scat_code
@@ -650,8 +645,8 @@ AUTO_SQL = [
             SELECT la_code, t1.scat_code, count(*),
             sum(total_area) as total_m2,
             sum(total_value) as total_value,
-            usr_median(total_area) as median_m2,
-            usr_median(total_value/total_area) as median_price_per_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY total_area) as median_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY total_value/total_area) as median_price_per_m2,
             t2.median_price_per_m2 as national_price_per_m2
             FROM {t1} t1
             LEFT OUTER JOIN {t2} t2 on t1.scat_code = t2.scat_code
@@ -950,13 +945,13 @@ AND a.la_code = la.la_code
             count(nullif(v.prop_empty = false, true)) vacant_count,
             wage_employee average_wage,
             sum(area) total_area,
-            usr_median(area) median_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY area) median_area,
             min(area) min_area,
             max(area) max_area,
-            usr_median(rateable_value) median_rateable_value,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY rateable_value) median_rateable_value,
             min(rateable_value) min_rateable_value,
             max(rateable_value) max_rateable_value,
-            usr_median(safe_divide(rateable_value, area)) median_rate_per_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY safe_divide(rateable_value, area)) median_rate_per_area,
             min(safe_divide(rateable_value, area)) min_rate_per_area,
             max(safe_divide(rateable_value, area)) max_rate_per_area,
             sum(break_even) total_break_even,
@@ -982,13 +977,13 @@ AND a.la_code = la.la_code
             count(nullif(v.prop_empty = false, true)) vacant_count,
             wage_employee average_wage,
             sum(area) total_area,
-            usr_median(area) median_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY area) median_area,
             min(area) min_area,
             max(area) max_area,
-            usr_median(rateable_value) median_rateable_value,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY rateable_value) median_rateable_value,
             min(rateable_value) min_rateable_value,
             max(rateable_value) max_rateable_value,
-            usr_median(safe_divide(rateable_value, area)) median_rate_per_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY safe_divide(rateable_value, area)) median_rate_per_area,
             min(safe_divide(rateable_value, area)) min_rate_per_area,
             max(safe_divide(rateable_value, area)) max_rate_per_area,
             sum(break_even) total_break_even,
@@ -1014,13 +1009,13 @@ AND a.la_code = la.la_code
             count(nullif(v.prop_empty = false, true)) vacant_count,
             wage_employee average_wage,
             sum(area) total_area,
-            usr_median(area) median_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY area) median_area,
             min(area) min_area,
             max(area) max_area,
-            usr_median(rateable_value) median_rateable_value,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY rateable_value) median_rateable_value,
             min(rateable_value) min_rateable_value,
             max(rateable_value) max_rateable_value,
-            usr_median(safe_divide(rateable_value, area)) median_rate_per_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY safe_divide(rateable_value, area)) median_rate_per_area,
             min(safe_divide(rateable_value, area)) min_rate_per_area,
             max(safe_divide(rateable_value, area)) max_rate_per_area,
             sum(break_even) total_break_even,
@@ -1046,13 +1041,13 @@ AND a.la_code = la.la_code
             count(nullif(v.prop_empty = false, true)) vacant_count,
             wage_employee average_wage,
             sum(area) total_area,
-            usr_median(area) median_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY area) median_area,
             min(area) min_area,
             max(area) max_area,
-            usr_median(rateable_value) median_rateable_value,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY rateable_value) median_rateable_value,
             min(rateable_value) min_rateable_value,
             max(rateable_value) max_rateable_value,
-            usr_median(safe_divide(rateable_value, area)) median_rate_per_area,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY safe_divide(rateable_value, area)) median_rate_per_area,
             min(safe_divide(rateable_value, area)) min_rate_per_area,
             max(safe_divide(rateable_value, area)) max_rate_per_area,
             sum(break_even) total_break_even,
@@ -1076,8 +1071,8 @@ AND a.la_code = la.la_code
         'name': 's_la_median_scat_ratable_breakeven',
         'sql': '''
              SELECT scat_code,
-             usr_median(total_rateable_value) median_total_rateable_value,
-             usr_median(total_break_even) median_total_break_even
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_rateable_value) median_total_rateable_value,
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_break_even) median_total_break_even
              FROM {t1} GROUP BY scat_code
         ''',
         'tables': ['s_la_general_summary'],
@@ -1089,8 +1084,8 @@ AND a.la_code = la.la_code
         'name': 's_msoa_median_scat_ratable_breakeven',
         'sql': '''
              SELECT scat_code,
-             usr_median(total_rateable_value) median_total_rateable_value,
-             usr_median(total_break_even) median_total_break_even
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_rateable_value) median_total_rateable_value,
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_break_even) median_total_break_even
              FROM {t1} GROUP BY scat_code
         ''',
         'tables': ['s_msoa_general_summary'],
@@ -1103,8 +1098,8 @@ AND a.la_code = la.la_code
         'name': 's_lsoa_median_scat_ratable_breakeven',
         'sql': '''
              SELECT scat_code,
-             usr_median(total_rateable_value) median_total_rateable_value,
-             usr_median(total_break_even) median_total_break_even
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_rateable_value) median_total_rateable_value,
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_break_even) median_total_break_even
              FROM {t1} GROUP BY scat_code
         ''',
         'tables': ['s_lsoa_general_summary'],
@@ -1264,8 +1259,8 @@ AND a.la_code = la.la_code
         'name': 's_lsoa_median_scat_ratable_breakeven',
         'sql': '''
              SELECT scat_code,
-             usr_median(total_rateable_value) median_total_rateable_value,
-             usr_median(total_break_even) median_total_break_even
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_rateable_value) median_total_rateable_value,
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_break_even) median_total_break_even
              FROM {t1} GROUP BY scat_code
         ''',
         'tables': ['s_lsoa_general_summary'],
@@ -1277,8 +1272,8 @@ AND a.la_code = la.la_code
         'name': 's_msoa_median_scat_ratable_breakeven',
         'sql': '''
              SELECT scat_code,
-             usr_median(total_rateable_value) median_total_rateable_value,
-             usr_median(total_break_even) median_total_break_even
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_rateable_value) median_total_rateable_value,
+             percentile_cont(0.5) WITHIN GROUP (ORDER BY total_break_even) median_total_break_even
              FROM {t1} GROUP BY scat_code
         ''',
         'tables': ['s_msoa_general_summary'],
@@ -1796,8 +1791,8 @@ AND a.la_code = la.la_code
             sum(v.total_area) as total_m2,
             sum(v.total_value) as total_value,
             avg(v.total_area) as mean_m2,
-            usr_median(v.total_area) as median_m2,
-            usr_mode(v.total_area) as mode_m2,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY v.total_area) as median_m2,
+            mode() WITHIN GROUP (ORDER BY v.total_area) as mode_m2,
             sum(v.total_area * v.unadjusted_price) as total_area_price,
             (sum(v.total_area * v.unadjusted_price) - sum(v.total_value)) as diff
             FROM {t1} v
@@ -1902,10 +1897,13 @@ def get_file(directory, prefix):
             return os.path.join(directory, file)
 
 
-def vao_reader(data_type):
+def vao_reader():
+    ''' Single pass over the SMV file yielding (record_type, row) with the
+    uarn and version of the owning 01 record added to each row '''
     f = get_file(os.path.join(config.DATA_PATH, DIRECTORY),'SMV')
     reader = unicode_csv_reader(f, encoding='latin-1', delimiter='*')
     uarn = None
+    base_version = None
     versions = {}
     for row in reader:
         r_type = row[0]
@@ -1913,20 +1911,14 @@ def vao_reader(data_type):
             uarn = row[2]
             versions[uarn] = versions.get(uarn, 0) + 1
             base_version = versions[uarn]
-        if r_type == data_type:
-            if r_type == '01':
-                row = row[:3] + [base_version] + row[3:]
-            else:
-                row = [uarn, base_version] + row
-            yield row
+            row = row[:3] + [base_version] + row[3:]
+        else:
+            row = [uarn, base_version] + row
+        yield r_type, row
 
 
 def import_vao_summary(verbose=False):
-    for rec_type, table, fields in vao_types:
-        if verbose:
-            print('importing %s' % table)
-        reader = vao_reader(rec_type)
-        import_csv(reader, table, fields=fields, verbose=verbose)
+    import_demux(vao_reader(), vao_types, verbose=verbose)
 
 
 def import_vao_list(verbose=False):
@@ -1937,6 +1929,11 @@ def import_vao_list(verbose=False):
     import_csv(reader, VAO_LIST_TABLE, fields=vao_list_fields, verbose=verbose)
 
 
-def importer(verbose=False):
-    import_vao_list(verbose=verbose)
-    import_vao_summary(verbose=verbose)
+def importer(verbose=False, workers=None):
+    jobs = [
+        (VAO_LIST_TABLE, import_vao_list, [], {'verbose': verbose}),
+        ('vao_summary', import_vao_summary, [], {'verbose': verbose}),
+    ]
+    # load before the workers fork so they share the lookup data
+    prewarm(['ba_2_la'])
+    raise_errors(run_jobs(jobs, workers=workers, verbose=verbose))
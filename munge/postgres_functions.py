@@ -1,95 +1,66 @@
 from sa_util import run_sql
 
 
+# munge needs PostgreSQL 9.5 or later.
+#
+# Summaries use the built in ordered-set aggregates, eg
+#   percentile_cont(0.5) WITHIN GROUP (ORDER BY x)
+#   mode() WITHIN GROUP (ORDER BY x)
+# and for ad-hoc queries array_median and array_mode take the array made by
+# array_agg, eg array_median(array_agg(x)).  array_agg keeps its state in
+# place so these are linear, unlike the old usr_median, usr_mode and
+# usr_median2 aggregates that copied their array with array_append on
+# every row.
 sql = '''
 BEGIN;
--- https://wiki.postgresql.org/wiki/Aggregate_Median
-CREATE OR REPLACE FUNCTION _final_median(anyarray) RETURNS float8 AS $$
-  WITH q AS
-  (
-     SELECT val
-     FROM unnest($1) val
-     WHERE VAL IS NOT NULL
-     ORDER BY 1
-  ),
-  cnt AS
-  (
-    SELECT COUNT(*) AS c FROM q
-  )
-  SELECT AVG(val)::float8
-  FROM
-  (
-    SELECT val FROM q
-    LIMIT  2 - MOD((SELECT c FROM cnt), 2)
-    OFFSET GREATEST(CEIL((SELECT c FROM cnt) / 2.0) - 1,0)
-  ) q2;
-$$ LANGUAGE SQL IMMUTABLE;
-
-DROP AGGREGATE IF EXISTS usr_median(anyelement);
-
-CREATE AGGREGATE usr_median(anyelement) (
-  SFUNC=array_append,
-  STYPE=anyarray,
-  FINALFUNC=_final_median,
-  INITCOND='{}'
-);
-
-
--- https://wiki.postgresql.org/wiki/Aggregate_Mode
-
-CREATE OR REPLACE FUNCTION _final_mode(anyarray)
-  RETURNS anyelement AS
-$BODY$
-    SELECT a
-    FROM unnest($1) a
-    GROUP BY 1
-    ORDER BY COUNT(1) DESC, 1
-    LIMIT 1;
-$BODY$
-LANGUAGE SQL IMMUTABLE;
-
--- Tell Postgres how to use our aggregate
-DROP AGGREGATE IF EXISTS usr_mode(anyelement);
-
-CREATE AGGREGATE usr_mode(anyelement) (
-  SFUNC=array_append, --Function to call for each row. Just builds the array
-  STYPE=anyarray,
-  FINALFUNC=_final_mode, --Function to call after everything has been added to array
-  INITCOND='{}' --Initialize an empty array when starting
-);
 
+CREATE OR REPLACE FUNCTION array_median(anyarray) RETURNS float8 AS $$
+  SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY val::float8)
+  FROM unnest($1) val;
+$$ LANGUAGE SQL IMMUTABLE;
 
-CREATE OR REPLACE FUNCTION _final_median2(anyarray) RETURNS float8 AS $$
-
-  WITH y AS (
-     SELECT val, row_number() OVER (ORDER BY total_area) AS rn
-     FROM unnest($1) val
-     WHERE VAL IS NOT NULL
-   )
-  , c AS (SELECT count(*) AS ct FROM y)
-
-SELECT CASE WHEN c.ct%2 = 0 THEN
-          round((SELECT avg(val) FROM y WHERE y.rn IN (c.ct/2, c.ct/2+1)), 3)
-       ELSE
-                (SELECT     val  FROM y WHERE y.rn = (c.ct+1)/2)
-       END AS median
-FROM   c;
+CREATE OR REPLACE FUNCTION array_mode(anyarray) RETURNS anyelement AS $$
+  SELECT mode() WITHIN GROUP (ORDER BY val)
+  FROM unnest($1) val;
 $$ LANGUAGE SQL IMMUTABLE;
 
-DROP AGGREGATE IF EXISTS usr_median2(anyelement);
+COMMIT;
+'''
+
+run_sql(sql)
 
-CREATE AGGREGATE usr_median2(anyelement) (
-  SFUNC=array_append,
-  STYPE=anyarray,
-  FINALFUNC=_final_median2,
-  INITCOND='{}'
-);
 
+# The old aggregates are dropped with their final functions, unless a view
+# in the database still uses one.  Those are left installed until the view
+# has been rebuilt from the current definitions and db_functions is run
+# again.
+OLD_AGGREGATES = ['usr_median', 'usr_mode', 'usr_median2']
+
+users_sql = '''
+SELECT string_agg(DISTINCT c.relname, ', ')
+FROM pg_depend d
+JOIN pg_rewrite r ON r.oid = d.objid
+JOIN pg_class c ON c.oid = r.ev_class
+WHERE d.classid = 'pg_rewrite'::regclass
+AND d.refclassid = 'pg_proc'::regclass
+AND d.refobjid = to_regprocedure(:aggregate)
+'''
 
+drop_sql = '''
+BEGIN;
+DROP AGGREGATE IF EXISTS {name}(anyelement);
+DROP FUNCTION IF EXISTS _final_{final}(anyarray);
 COMMIT;
 '''
 
-run_sql(sql)
+for name in OLD_AGGREGATES:
+    users = run_sql(users_sql, aggregate='%s(anyelement)' % name).scalar()
+    if users:
+        print('%s is still used by %s, it has not been dropped' % (
+            name, users
+        ))
+        continue
+    run_sql(drop_sql.format(name=name, final=name[len('usr_'):]))
 
 
 sql = '''
@@ -0,0 +1,48 @@
+import collections
+import threading
+
+
+class ResponseCache(object):
+    ''' Least recently used cache of responses.
+
+    Each entry is stored with the version of the data it was made from and
+    is only returned while that version is current. '''
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        ''' Returns the cached value or None '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            # most recently used go last
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (version, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -49,6 +49,48 @@ def run_sql(engine, sql, *args, **kw):
     return engine.execute(sql, *args, **kw)
 
 
+class StreamResult(object):
+    ''' Rows of a query read through a named psycopg2 cursor, itersize rows
+    per round trip.  SQLAlchemy 1.0 buffers at most 1000 rows of a
+    stream_results query whatever max_row_buffer is, so the cursor is used
+    directly.  Provides the parts of a ResultProxy the builds use. '''
+
+    count = 0
+
+    def __init__(self, engine, sql, fetch_size, **kw):
+        compiled = sa.sql.text(sql).bindparams(**kw).compile(
+            dialect=engine.dialect
+        )
+        StreamResult.count += 1
+        self.connection = engine.raw_connection()
+        self.cursor = self.connection.cursor(
+            name='munge_stream_%s' % StreamResult.count
+        )
+        self.cursor.itersize = fetch_size
+        self.cursor.execute(unicode(compiled), compiled.params)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def keys(self):
+        # a named cursor only has a description once rows are fetched
+        return [col[0] for col in self.cursor.description]
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.cursor.close()
+        self.connection.rollback()
+        self.connection.close()
+        self.connection = None
+
+
+def stream_sql(engine, sql, fetch_size, **kw):
+    ''' Run sql using a server side cursor, rows are fetched fetch_size at a
+    time so the full result is never held in memory '''
+    return StreamResult(engine, sql, fetch_size, **kw)
+
+
 def get_sequence_names(engine):
     sql = "SELECT c.relname FROM pg_class c WHERE c.relkind = 'S';"
     result = engine.execute(sql)
@@ -152,6 +194,144 @@ def get_indexes(engine, table_name):
         return []
 
 
+class Catalog(object):
+    ''' Snapshot of the tables, views, sequences, indexes and primary keys
+    in the public schema.  It is loaded with two catalog queries on first
+    use and must be invalidated after any DDL. '''
+
+    relations_sql = '''
+        SELECT c.relname, c.relkind, c.relowner != 10
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public'
+        AND c.relkind IN ('r', 'v', 'S');
+    '''
+
+    indexes_sql = '''
+        SELECT t.relname, i.relname, x.indisprimary, x.indisunique,
+        ARRAY(
+            SELECT a.attname
+            FROM generate_subscripts(x.indkey::int2[], 1) k
+            JOIN pg_attribute a ON a.attrelid = x.indrelid
+            AND a.attnum = (x.indkey::int2[])[k]
+            ORDER BY k
+        )
+        FROM pg_index x
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE n.nspname = 'public';
+    '''
+
+    columns_sql = '''
+        SELECT c.relname, a.attname, format_type(a.atttypid, NULL)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public'
+        AND c.relkind IN ('r', 'v')
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum;
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.invalidate()
+
+    def invalidate(self):
+        self.loaded = False
+        self.columns = None
+
+    def load(self):
+        self.tables = []
+        self.views = []
+        self.user_views = []
+        self.sequences = []
+        for name, kind, user in self.engine.execute(self.relations_sql):
+            if kind == 'r':
+                self.tables.append(name)
+            elif kind == 'S':
+                self.sequences.append(name)
+            else:
+                self.views.append(name)
+                if user:
+                    self.user_views.append(name)
+        self.indexes = {}
+        self.pks = {}
+        result = self.engine.execute(self.indexes_sql)
+        for table, name, primary, unique, columns in result:
+            if primary:
+                self.pks[table] = {
+                    'name': name,
+                    'constrained_columns': list(columns),
+                }
+            else:
+                self.indexes.setdefault(table, []).append({
+                    'name': name,
+                    'column_names': list(columns),
+                    'unique': unique,
+                })
+        self.loaded = True
+
+    def _check(self):
+        if not self.loaded:
+            self.load()
+
+    def table_list(self):
+        self._check()
+        return list(self.tables)
+
+    def view_list(self):
+        self._check()
+        return list(self.views)
+
+    def table_view_list(self):
+        self._check()
+        return self.tables + self.user_views
+
+    def sequence_names(self):
+        self._check()
+        return list(self.sequences)
+
+    def get_indexes(self, table_name):
+        self._check()
+        return self.indexes.get(table_name, [])
+
+    def get_pk_constraint(self, table_name):
+        self._check()
+        return self.pks.get(
+            table_name, {'name': None, 'constrained_columns': []}
+        )
+
+    def get_primary_keys(self, table_name):
+        return self.get_pk_constraint(table_name)['constrained_columns']
+
+    def get_columns(self, table_name):
+        ''' List of (name, type) of the columns of a table or view, these
+        are only loaded when first asked for '''
+        if self.columns is None:
+            self.columns = {}
+            for table, name, type_ in self.engine.execute(self.columns_sql):
+                self.columns.setdefault(table, []).append(
+                    (name, field_type(type_))
+                )
+        return self.columns.get(table_name, [])
+
+    def get_fields(self, table_name):
+        ''' Field info of table_name as returned by get_result_fields '''
+        pks = self.get_primary_keys(table_name)
+        indexed = set()
+        for index in self.get_indexes(table_name):
+            indexed.update(index['column_names'])
+        return [{
+            'name': name,
+            'type': type_,
+            'pk': name in pks,
+            'indexed': name in indexed,
+        } for name, type_ in self.get_columns(table_name)]
+
+
 def get_result_fields(engine, result, table=None):
     types = [OID_TYPE.get(col[1], col[1]) for col in result.cursor.description]
     if table:
@@ -1,4 +1,7 @@
+import hashlib
+import inspect
 import time
+from multiprocessing.pool import ThreadPool
 
 import sqlalchemy as sa
 
@@ -9,8 +12,23 @@ from summeries import update_summary_table as _update_summary_table
 import definitions
 
 
+# connections are only made when first used so the module can be
+# imported without a database
 engine = sa.create_engine(config.CONNECTION_STRING, echo=False)
-conn = engine.connect()
+catalog = sa_common.Catalog(engine)
+
+
+def dispose_engine():
+    ''' Close all connections, needed before forking worker processes so
+    that no connection is shared between processes '''
+    engine.dispose()
+
+
+def reset_engine():
+    ''' Give this process its own engine '''
+    global engine, catalog
+    engine = sa.create_engine(config.CONNECTION_STRING, echo=False)
+    catalog = sa_common.Catalog(engine)
 
 fields_match = sa_common.fields_match
 
@@ -19,28 +37,32 @@ def run_sql(*args, **kw):
     return sa_common.run_sql(engine, *args, **kw)
 
 
-def get_indexes(*args, **kw):
-    return sa_common.get_indexes(engine, *args, **kw)
+def stream_sql(sql, **kw):
+    return sa_common.stream_sql(engine, sql, config.STREAM_FETCH_SIZE, **kw)
 
 
-def get_primary_keys(*args, **kw):
-    return sa_common.get_primary_keys(engine, *args, **kw)
+def get_indexes(table_name):
+    return catalog.get_indexes(table_name)
 
 
-def get_pk_constraint(*args, **kw):
-    return sa_common.get_pk_constraint(engine, *args, **kw)
+def get_primary_keys(table_name):
+    return catalog.get_primary_keys(table_name)
+
+
+def get_pk_constraint(table_name):
+    return catalog.get_pk_constraint(table_name)
 
 
 def table_list():
-    return sa_common.table_list(engine)
+    return catalog.table_list()
 
 
 def view_list():
-    return sa_common.view_list(engine)
+    return catalog.view_list()
 
 
 def table_view_list():
-    return sa_common.table_view_list(engine)
+    return catalog.table_view_list()
 
 
 def table_columns(table_name):
@@ -52,14 +74,15 @@ def dependent_objects():
 
 
 def get_sequence_names():
-    return sa_common.get_sequence_names(engine)
+    return catalog.sequence_names()
 
 
 def get_result_fields(*args, **kw):
     return sa_common.get_result_fields(engine, *args, **kw)
 
 
-def update_summary_table(data, created=True, rows=None, time=None):
+def update_summary_table(data, created=True, rows=None, time=None,
+                         fingerprint=None):
     name = data['name']
     tables = data['tables']
     importer = data.get('importer')
@@ -72,7 +95,8 @@ def update_summary_table(data, created=True, rows=None, time=None):
                           rows=rows,
                           time=time,
                           is_view=is_view,
-                          created=created)
+                          created=created,
+                          fingerprint=fingerprint)
 
 
 def clear_temp_objects(verbose=0):
@@ -117,6 +141,7 @@ def drop_table_or_view(table, verbose=0, force=False):
     if verbose < 1:
         print(sql)
     run_sql(sql)
+    catalog.invalidate()
 
 
 def truncate_table(table, verbose=0):
@@ -136,18 +161,28 @@ def quoted_temp_table_name(name):
     return quote(config.TEMP_TABLE_STR + name)
 
 
-def swap_tables(verbose=0, force=False):
-    ''' SWAPS our temp tables, including renaming indexes and sequences
+def swap_tables(verbose=0, force=False, tables=None):
+    ''' SWAPS our temp tables, including renaming indexes and sequences.
+    With tables only the temp tables and views of those names are swapped,
+    others such as a part loaded import are left alone.
     '''
     from dependencies import dependencies_manager
     temp_table_str = config.TEMP_TABLE_STR
     tmp_label_len = len(temp_table_str)
-    tables = [t for t in table_list() if t.startswith(temp_table_str)]
+    only = tables
+
+    def wanted(name):
+        return only is None or name in only
+
+    tables = [
+        t for t in table_list()
+        if t.startswith(temp_table_str) and wanted(t[tmp_label_len:])
+    ]
     # views
     view_names = [
         s[tmp_label_len:]
         for s in view_list()
-        if s.startswith(temp_table_str)
+        if s.startswith(temp_table_str) and wanted(s[tmp_label_len:])
     ]
     view_names = dependencies_manager.sort_deps(view_names)
     view_names.reverse()
@@ -196,7 +231,10 @@ def swap_tables(verbose=0, force=False):
     sequence_names = [
         s[tmp_label_len:]
         for s in get_sequence_names()
-        if s.startswith(temp_table_str)
+        if s.startswith(temp_table_str) and (
+            only is None or
+            any([s[tmp_label_len:].startswith(t + '_') for t in only])
+        )
     ]
     for name in sequence_names:
         if verbose:
@@ -207,10 +245,43 @@ def swap_tables(verbose=0, force=False):
             old_name=quoted_temp_table_name(name),
         ))
 
+    # mark the swapped tables as updated so cached responses built from
+    # the old ones are dropped
+    swapped = view_names + [t[tmp_label_len:] for t in tables]
+    if swapped and 'table_summaries' in table_list():
+        sql = '''
+            UPDATE table_summaries SET updated = LOCALTIMESTAMP
+            WHERE name IN ({names});
+        '''
+        sql_list.append(sql.format(names=', '.join(
+            ["'%s'" % name.replace("'", "''") for name in swapped]
+        )))
+
     sql_list.append('COMMIT;')
     if verbose > 1:
         print('\n'.join(sql_list))
-    conn.execute('\n'.join(sql_list))
+    engine.execute('\n'.join(sql_list))
+    catalog.invalidate()
+
+
+def recreate_dependent_views(tables, verbose=0):
+    ''' Rebuild the defined views depending on tables that no longer
+    exist, as after the tables were swapped with force '''
+    from dependencies import dependencies_manager
+    views = definitions.defined_views()
+    existing = view_list()
+    needed = [
+        item for item in dependencies_manager.updates_for(tables,
+                                                          include=False)
+        if item in views and item not in existing
+    ]
+    if not needed:
+        return
+    build_views_and_summaries(items=needed,
+                              dependencies=False,
+                              verbose=verbose,
+                              incremental=False)
+    swap_tables(verbose=verbose, tables=needed)
 
 
 def quote(arg):
@@ -230,15 +301,38 @@ def make_tables_dict(tables):
     return output
 
 
-def create_table(table, fields, primary_key=None, verbose=0, keep=False):
-    if keep:
+def primary_key_fields(fields, primary_key=None):
+    ''' Quoted names of the primary key columns '''
+    pk = []
+    if primary_key:
+        if isinstance(primary_key, basestring):
+            primary_key = [primary_key]
+        pk = [quote(name) for name in primary_key]
+    for field in fields:
+        if field['pk']:
+            pk.append(quote(field['name']))
+    return pk
+
+
+def create_table(table, fields, primary_key=None, verbose=0, keep=False,
+                 defer_pk=False, unlogged=False, drop=True):
+    ''' Create table, with defer_pk the primary key is left for
+    build_indexes to add once the data is loaded.  An unlogged table skips
+    the WAL, see set_logged.  Without drop an existing table is left as it
+    is. '''
+    if not drop:
+        keep = True
+    elif keep:
         old_fields = table_columns(table)
         if not fields_match(old_fields, fields):
             keep = False
     if not keep:
         sql = 'DROP TABLE IF EXISTS %s' % quote(table)
         run_sql(sql)
-    sql = ['CREATE TABLE IF NOT EXISTS %s (' % quote(table)]
+    sql = ['CREATE {unlogged}TABLE IF NOT EXISTS {table} ('.format(
+        unlogged='UNLOGGED ' if unlogged else '',
+        table=quote(table),
+    )]
     sql_fields = []
     for field in fields:
         # Skipped field
@@ -250,15 +344,8 @@ def create_table(table, fields, primary_key=None, verbose=0, keep=False):
         )
         sql_fields.append(col)
     # Primary Key
-    pk = []
-    if primary_key:
-        if isinstance(primary_key, basestring):
-            primary_key = [primary_key]
-        pk = primary_key
-    for field in fields:
-        if field['pk']:
-            pk.append('"%s"' % field['name'])
-    if pk:
+    pk = primary_key_fields(fields, primary_key)
+    if pk and not defer_pk:
         sql_fields.append('\tPRIMARY KEY (%s)' % ', '.join(pk))
     sql.append(',\n'.join(sql_fields))
     sql.append(')')
@@ -268,9 +355,61 @@ def create_table(table, fields, primary_key=None, verbose=0, keep=False):
         if verbose > 1:
             print(sql)
     run_sql(sql)
+    catalog.invalidate()
+
+
+def ensure_table(table, fields, verbose=0):
+    ''' Create table and its indexes unless they exist.  Nothing is dropped
+    so several processes can call it at once. '''
+    try:
+        create_table(table, fields, verbose=verbose, drop=False)
+    except sa.exc.DBAPIError:
+        # another process created it between IF NOT EXISTS and the insert
+        # into the system catalogs
+        catalog.invalidate()
+        if table not in table_list():
+            raise
+    build_indexes(table, fields, verbose=verbose, if_not_exists=True)
+
+
+def set_logged(table, verbose=0):
+    ''' Make an UNLOGGED staging table crash safe once its load has
+    succeeded, the table is written to the WAL in one pass '''
+    sql = 'ALTER TABLE %s SET LOGGED' % quote(table)
+    if verbose > 1:
+        print(sql)
+    run_sql(sql)
+
 
+def keep_unlogged(data):
+    ''' Definitions with `unlogged` set are cheap to regenerate so their
+    tables are left unlogged, they are emptied after a database crash '''
+    return bool(data.get('unlogged'))
 
-def build_indexes(table_name, t_fields, verbose=0):
+
+def _run_maintenance_sql(sql):
+    ''' Run sql on its own connection using the configured
+    maintenance_work_mem, returns the time taken '''
+    start = time.time()
+    connection = engine.connect()
+    try:
+        with connection.begin():
+            if config.MAINTENANCE_WORK_MEM:
+                connection.execute(
+                    "SET LOCAL maintenance_work_mem = '%s'"
+                    % config.MAINTENANCE_WORK_MEM
+                )
+            connection.execute(sql)
+    finally:
+        connection.close()
+    return time.time() - start
+
+
+def build_indexes(table_name, t_fields, verbose=0, primary_key=None,
+                  workers=None, if_not_exists=False):
+    ''' Create the indexes of table_name, and its primary key when it was
+    created with defer_pk.  The indexes are built at the same time each on
+    its own connection. '''
     # get indexed fields
     index_fields = [
         (f['index_key'], f['name'])
@@ -291,29 +430,71 @@ def build_indexes(table_name, t_fields, verbose=0):
     sql_list = []
     for index in indexes:
         quoted_index_fields = ['"%s"' % i for i in index]
-        sql = 'CREATE INDEX "{idx_name}" ON "{table}" ({index});'
+        sql = 'CREATE INDEX {exists}"{idx_name}" ON "{table}" ({index});'
         sql = sql.format(
+            exists='IF NOT EXISTS ' if if_not_exists else '',
             idx_name='%s_idx_%s' % (table_name, '_'.join(index)),
             table=table_name,
             index=', '.join(quoted_index_fields),
         )
         sql_list.append(sql)
-        if verbose:
-            print('creating index of %s' % index)
-            print sql
-    if sql_list:
-        run_sql('\n'.join(sql_list))
+    # primary key, only if the table does not already have one
+    pk_name = '%s_pkey' % table_name
+    if primary_key and not get_pk_constraint(table_name)['name']:
+        sql = 'CREATE UNIQUE INDEX {idx_name} ON {table} ({index});'
+        sql_list.insert(0, sql.format(
+            idx_name=quote(pk_name),
+            table=quote(table_name),
+            index=', '.join(primary_key),
+        ))
+    else:
+        primary_key = None
+    if not sql_list:
+        return
 
+    if workers is None:
+        workers = config.INDEX_WORKERS
+    workers = max(1, min(workers, len(sql_list)))
+    start = time.time()
+    if workers == 1:
+        timings = [_run_maintenance_sql(sql) for sql in sql_list]
+    else:
+        pool = ThreadPool(workers)
+        try:
+            timings = pool.map(_run_maintenance_sql, sql_list, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if primary_key:
+        sql = 'ALTER TABLE {table} ADD CONSTRAINT {name} ' \
+            'PRIMARY KEY USING INDEX {name};'
+        run_sql(sql.format(table=quote(table_name), name=quote(pk_name)))
+    catalog.invalidate()
+    if verbose:
+        for sql, seconds in zip(sql_list, timings):
+            print('{seconds:.1f}s {sql}'.format(seconds=seconds, sql=sql))
+        print('{table}: indexes built in {seconds:.1f}s'.format(
+            table=table_name, seconds=time.time() - start
+        ))
 
-def insert_rows(table, fields):
-    sql = ['INSERT INTO "%s" (' % table]
-    sql_fields = []
-    data_fields = []
+
+def insert_fields(fields):
+    ''' Fields that are supplied when inserting rows '''
+    out = []
     for field in fields:
         if field['type'] is None:
             continue
         if field.get('missing') is True and field.get('fn') is None:
             continue
+        out.append(field)
+    return out
+
+
+def insert_rows(table, fields):
+    sql = ['INSERT INTO "%s" (' % table]
+    sql_fields = []
+    data_fields = []
+    for field in insert_fields(fields):
         sql_fields.append('"%s"' % (
             field['name']
         ))
@@ -328,17 +509,20 @@ def insert_rows(table, fields):
 def results_dict(sql):
     first = True
     count = 0
-    results = run_sql(sql)
-    for row in results:
-        if first:
-            fields = get_result_fields(results)
-            f = [field['name'] for field in fields]
-            first = False
-        row_data = dict(zip(f, row))
-        yield row_data
+    results = stream_sql(sql)
+    try:
+        for row in results:
+            if first:
+                fields = get_result_fields(results)
+                f = [field['name'] for field in fields]
+                first = False
+            row_data = dict(zip(f, row))
+            yield row_data
+    finally:
+        results.close()
 
 
-def _build_summary(data, verbose=0, limit=None):
+def _build_summary(data, verbose=0, limit=None, fingerprint=None):
     start = time.time()
     table_name = data['name']
     sql = data['sql']
@@ -347,23 +531,29 @@ def _build_summary(data, verbose=0, limit=None):
     if verbose:
         print('creating summary table %s' % table_name)
     tables_dict = make_tables_dict(tables)
+    sql = sql.format(**tables_dict)
     if verbose > 1:
-        print(sql.format(**tables_dict))
-    results = run_sql(sql.format(**tables_dict))
+        print(sql)
 
     row_function = data.get('row_function')
     table_function = data.get('table_function')
-    if row_function:
-        count = _results_to_row_function(row_function, data, results, verbose=verbose, limit=limit)
-    if table_function:
-        count = _results_to_table_function(table_function, data, results, verbose=verbose, limit=limit)
+    if row_function or table_function:
+        results = stream_sql(sql)
+        try:
+            if row_function:
+                count = _results_to_row_function(row_function, data, results, verbose=verbose, limit=limit)
+            else:
+                count = _results_to_table_function(table_function, data, results, verbose=verbose, limit=limit)
+        finally:
+            # release the server side cursor and its connection
+            results.close()
     else:
-        count = _results_to_table(data, results, verbose=verbose, limit=limit)
+        count = _sql_to_table(data, sql, verbose=verbose, limit=limit)
     elapsed = int(time.time() - start)
     m, s = divmod(elapsed, 60)
     h, m = divmod(m, 60)
     t = "%d:%02d:%02d" % (h, m, s)
-    update_summary_table(data, rows=count, time=t)
+    update_summary_table(data, rows=count, time=t, fingerprint=fingerprint)
 
 
 def _results_to_table_function(function, data, results, verbose=0, limit=None):
@@ -381,7 +571,9 @@ def _results_to_table_function(function, data, results, verbose=0, limit=None):
             create_table(table_name_temp,
                          fields,
                          primary_key=primary_key,
-                         verbose=verbose)
+                         verbose=verbose,
+                         defer_pk=config.DEFER_PRIMARY_KEYS,
+                         unlogged=config.UNLOGGED_STAGING)
             insert_sql = insert_rows(table_name_temp, fields)
             first = False
         else:
@@ -404,9 +596,13 @@ def _results_to_table_function(function, data, results, verbose=0, limit=None):
         print('{table}: {count:,} rows imported'.format(
             table=table_name, count=count
         ))
-    if count:
-        # Add indexes
-        build_indexes(table_name_temp, fields, verbose=verbose)
+    if not first:
+        # the table was created, even with no rows it must be made logged
+        # and needs its indexes and deferred primary key
+        if config.UNLOGGED_STAGING and not keep_unlogged(data):
+            set_logged(table_name_temp, verbose=verbose)
+        build_indexes(table_name_temp, fields, verbose=verbose,
+                      primary_key=primary_key_fields(fields, primary_key))
     return count
 
 
@@ -430,7 +626,9 @@ def _results_to_row_function(function, data, results, verbose=0, limit=None):
             create_table(table_name_temp,
                          fields,
                          primary_key=primary_key,
-                         verbose=verbose)
+                         verbose=verbose,
+                         defer_pk=config.DEFER_PRIMARY_KEYS,
+                         unlogged=config.UNLOGGED_STAGING)
             insert_sql = insert_rows(table_name_temp, fields)
             first = False
         output.append(row_data)
@@ -451,54 +649,56 @@ def _results_to_row_function(function, data, results, verbose=0, limit=None):
         print('{table}: {count:,} rows imported'.format(
             table=table_name, count=count
         ))
-    if count:
-        # Add indexes
-        build_indexes(table_name_temp, fields, verbose=verbose)
+    if not first:
+        # the table was created, even with no rows it must be made logged
+        # and needs its indexes and deferred primary key
+        if config.UNLOGGED_STAGING and not keep_unlogged(data):
+            set_logged(table_name_temp, verbose=verbose)
+        build_indexes(table_name_temp, fields, verbose=verbose,
+                      primary_key=primary_key_fields(fields, primary_key))
     return count
 
 
-def _results_to_table(data, results, verbose=0, limit=None):
+def _sql_to_table(data, sql, verbose=0, limit=None):
+    ''' Build the table on the server using CREATE TABLE AS '''
     table_name = data['name']
     primary_key = data.get('primary_key')
     table_name_temp = config.TEMP_TABLE_STR + table_name
-    first = True
-    count = 0
-    output = []
-    for row in results:
-        if first:
-            fields = get_result_fields(results)
-            create_table(table_name_temp,
-                         fields,
-                         primary_key=primary_key,
-                         verbose=verbose)
-            f = [field['name'] for field in fields]
-            insert_sql = insert_rows(table_name_temp, fields)
-            first = False
-        output.append(dict(zip(f, row)))
-        count += 1
-        if count % config.BATCH_SIZE == 0:
-            run_sql(insert_sql, output)
-            output = []
-            if verbose:
-                print('{table}: {count:,}'.format(
-                    table=table_name, count=count
-                ))
-        if limit and count == limit:
-            break
-    if output:
-        run_sql(insert_sql, output)
+    sql = sql.strip().rstrip(';')
+    if limit:
+        sql = 'SELECT * FROM (\n%s\n) AS q LIMIT %d' % (sql, limit)
+    run_sql('DROP TABLE IF EXISTS %s' % quote(table_name_temp))
+    unlogged = config.UNLOGGED_STAGING
+    sql = 'CREATE {unlogged}TABLE {table} AS\n{sql}'.format(
+        unlogged='UNLOGGED ' if unlogged else '',
+        table=quote(table_name_temp),
+        sql=sql,
+    )
+    result = run_sql(sql)
+    # row count comes from the command status
+    count = result.rowcount
+    if unlogged and not keep_unlogged(data):
+        set_logged(table_name_temp, verbose=verbose)
+    if primary_key:
+        if isinstance(primary_key, basestring):
+            primary_key = [primary_key]
+        sql = 'ALTER TABLE {table} ADD PRIMARY KEY ({pk});'.format(
+            table=quote(table_name_temp),
+            pk=', '.join([quote(pk) for pk in primary_key]),
+        )
+        if verbose > 1:
+            print(sql)
+        run_sql(sql)
+    catalog.invalidate()
 
     if verbose:
-        print('{table}: {count:,} rows imported'.format(
+        print('{table}: {count:,} rows created'.format(
             table=table_name, count=count
         ))
-    if count:
-        # Add indexes
-        build_indexes(table_name_temp, fields, verbose=verbose)
     return count
 
 
-def _build_view(data, verbose=0, force=False):
+def _build_view(data, verbose=0, force=False, fingerprint=None):
     view_name = data['name']
     temp_view_name = config.TEMP_TABLE_STR + view_name
     sql = 'CREATE VIEW {name} AS\n'.format(name=quote(temp_view_name))
@@ -515,7 +715,8 @@ def _build_view(data, verbose=0, force=False):
     if verbose > 1:
         print(sql.format(**tables_dict))
     run_sql(sql.format(**tables_dict))
-    update_summary_table(data)
+    catalog.invalidate()
+    update_summary_table(data, fingerprint=fingerprint)
 
 
 def time_fn(fn, args=None, kw=None, verbose=0):
@@ -533,28 +734,134 @@ def time_fn(fn, args=None, kw=None, verbose=0):
         print "%d:%02d:%02d" % (h, m, s)
 
 
-def build_views_and_summaries(items, all=False, verbose=0, force=False, dependencies=True):
+def build_item(item, verbose=0, force=False, fingerprint=None):
+    info = definitions.get_definition(item)
+    kw = {'fingerprint': fingerprint}
+    if info.get('as_view'):
+        kw['force'] = force
+        time_fn(_build_view, args=[info], verbose=verbose, kw=kw)
+    else:
+        time_fn(_build_summary, args=[info], verbose=verbose, kw=kw)
+
+
+def function_fingerprint(fn):
+    ''' Hash of the source of fn so that editing it causes a rebuild,
+    changes to the functions it calls are not seen '''
+    if fn is None:
+        return None
+    try:
+        source = inspect.getsource(fn)
+    except (IOError, TypeError):
+        source = fn.__code__.co_code
+    return '%s:%s' % (fn.__name__, hashlib.md5(source).hexdigest())
+
+
+def definition_fingerprint(data, inputs):
+    ''' Hash of the definition and the fingerprints of its inputs, None if
+    any input fingerprint is unknown '''
+    parts = [
+        data.get('sql'),
+        repr(data.get('fields')),
+        repr(data.get('primary_key')),
+        repr(data.get('as_view', False)),
+    ]
+    for key in ['row_function', 'table_function']:
+        parts.append(function_fingerprint(data.get(key)))
+    for table in sorted(inputs):
+        if inputs[table] is None:
+            return None
+        parts.append('%s=%s' % (table, inputs[table]))
+    return hashlib.md5(repr(parts)).hexdigest()
+
+
+def plan_builds(updates, incremental=True):
+    ''' Work out the fingerprint each item will have once built and which
+    items can be skipped.  updates must be in dependency order.
+    Returns (builds, fingerprints, skipped) where builds and skipped are
+    lists of (item, reason).
+
+    Items with an input that will be swapped, one with a temp table waiting
+    or being rebuilt now, are always rebuilt.  Their old views or tables
+    would otherwise stop the input being dropped by swap_tables. '''
+    from summeries import get_fingerprints
+    stored = get_fingerprints()
+    existing = table_view_list()
+    fingerprints = {}
+    builds = []
+    skipped = []
+    swapping = set(
+        t[len(config.TEMP_TABLE_STR):] for t in existing
+        if t.startswith(config.TEMP_TABLE_STR)
+    )
+    for item in updates:
+        info = definitions.get_definition(item)
+        inputs = {}
+        for table in info['tables'] + info.get('dependencies', []):
+            inputs[table] = fingerprints.get(table, stored.get(table))
+        fingerprint = definition_fingerprint(info, inputs)
+        fingerprints[item] = fingerprint
+        replaced = sorted(t for t in inputs if t in swapping)
+        if fingerprint is None:
+            unknown = [t for t in sorted(inputs) if inputs[t] is None]
+            reason = 'no fingerprint for %s' % ', '.join(unknown)
+        elif stored.get(item) is None:
+            reason = 'not built before'
+        elif stored.get(item) != fingerprint:
+            reason = 'sql or inputs changed'
+        elif item not in existing:
+            reason = 'missing'
+        elif item in swapping:
+            reason = 'temp table waiting to be swapped'
+        elif replaced:
+            reason = '%s to be swapped' % ', '.join(replaced)
+        elif incremental:
+            skipped.append((item, 'sql and inputs unchanged'))
+            continue
+        else:
+            reason = 'full rebuild'
+        builds.append((item, reason))
+        swapping.add(item)
+    return builds, fingerprints, skipped
+
+
+def build_views_and_summaries(items, all=False, verbose=0, force=False,
+                              dependencies=True, workers=None,
+                              incremental=None):
+    # FIXME would be nice to move this to top of page
+    from dependencies import dependencies_manager
+    from workers import run_graph
     updates = []
     if not dependencies:
         updates = items
     if items and dependencies:
-        # FIXME would be nice to move this to top of page
-        from dependencies import dependencies_manager
         updates = dependencies_manager.updates_for(items)
     if all:
         updates = definitions.get_all_definition_names()
+    if incremental is None:
+        incremental = config.INCREMENTAL_BUILDS
+    updates = dependencies_manager.sort_deps(updates)
+    builds, fingerprints, skipped = plan_builds(updates, incremental)
+    for item, reason in skipped:
+        print 'skipped %s: %s' % (item, reason)
+    updates = [item for item, reason in builds]
+    jobs = []
+    for item, reason in builds:
+        if verbose:
+            print 'building %s: %s' % (item, reason)
+        kw = {
+            'verbose': verbose,
+            'force': force,
+            'fingerprint': fingerprints[item],
+        }
+        jobs.append((item, build_item, [item], kw))
+    errors = run_graph(jobs,
+                       dependencies_manager.dependencies_within(updates),
+                       workers=workers,
+                       verbose=verbose)
     for item in updates:
-        info = definitions.get_definition(item)
-        try:
-            if info.get('as_view'):
-                time_fn(_build_view, args=[info], verbose=verbose, kw={'force': force})
-            else:
-                time_fn(_build_summary, args=[info], verbose=verbose)
-        except Exception as e:
+        if item in errors:
             print 'failed %s' % item
-            print str(e)
-            continue
-
+            print errors[item]
 
 
 def _build_views_and_summaries(data, verbose=0, just_views=False, importer=None,
@@ -582,4 +889,5 @@ def swap_table(old_name, new_name):
         COMMIT;
     '''
     sql = sql.format(old_name=quote(old_name), new_name=quote(new_name))
-    conn.execute(sql)
+    engine.execute(sql)
+    catalog.invalidate()
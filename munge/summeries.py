@@ -13,15 +13,35 @@ table_fields = [
     'importer',
     'time',
     'rows:bigint',
+    'fingerprint',
 ]
 
 _initiated = False
 
 
 def _init():
-    sa_util.create_table('table_summaries',
-                         sa_util.process_header(table_fields),
-                         keep=True)
+    # nothing is dropped as build and import workers may all get here at
+    # once on a new database
+    fields = sa_util.process_header(table_fields)
+    sa_util.ensure_table('table_summaries', fields)
+    # add any new columns without losing the existing summaries
+    existing = [
+        f['name'] for f in sa_util.table_columns('table_summaries')
+    ]
+    for field in fields:
+        if field['name'] not in existing:
+            # another process may add it first
+            sql = '''
+            do
+            $$
+            begin
+                alter table table_summaries add column {} {};
+            exception when duplicate_column then
+                null;
+            end
+            $$;
+            '''.format(sa_util.quote(field['name']), field['type'])
+            sa_util.run_sql(sql)
     global _initiated
     _initiated = True
 
@@ -33,7 +53,8 @@ def update_summary_table(table_name,
                          created=False,
                          time=None,
                          rows=None,
-                         importer=None):
+                         importer=None,
+                         fingerprint=None):
     if not _initiated:
         _init()
     data = {
@@ -42,6 +63,7 @@ def update_summary_table(table_name,
         'importer': importer,
     }
     data['dependencies'] = dependencies
+    data['fingerprint'] = fingerprint
     if description:
         data['description'] = description
     data['updated'] = datetime.datetime.now()
@@ -66,3 +88,11 @@ def update_summary_table(table_name,
 
     sql = sql.format(columns=columns, values=values)
     sa_util.run_sql(sql, **data)
+
+
+def get_fingerprints():
+    ''' Returns dict of name: fingerprint of the last build or import '''
+    if not _initiated:
+        _init()
+    sql = 'SELECT name, fingerprint FROM table_summaries'
+    return dict((row[0], row[1]) for row in sa_util.run_sql(sql))
@@ -1,12 +1,20 @@
+import itertools
+import os
 import xlrd
 from os import listdir
 from os.path import isfile, join
 from datetime import datetime
-from decimal import Decimal
 
-import unicodecsv as csv
-
-from sa_util import run_sql
+import config
+from common import process_header
+from copy_util import copy_rows
+import import_errors
+import sa_util
+from workers import make_pool
+from sa_util import (
+    run_sql, create_table, swap_tables, table_list, quote,
+    recreate_dependent_views,
+)
 
 DIR = os.path.join(config.DATA_PATH, 'vacancy')
 
@@ -102,62 +110,58 @@ def make_ba_ref(row, idx, la):
         raise Exception('INVALID BA REF')
 
 
-def process(f):
-    out = []
-    errors = []
-    print f
-    parts = f.split('.')[0].split('_')
-    source = parts[0]
-    la = parts[1]
-    book = xlrd.open_workbook(join(DIR, f))
-    date_mode = book.datemode
-    sheet = book.sheet_by_index(0)
-    for x in xrange(1, sheet.nrows):
-        row = sheet.row(x)
-        try:
-            out.append(
-                [
-                    make_la_code(row, 0, la),
-                    make_ba_ref(row, 1, la),
-                    make_bool(row, 2),
-                    make_date(row, 3, date_mode),
-                    make_bool(row, 4),
-                    make_date(row, 5, date_mode),
-                    make_number(row, 6),
-                    row[7].value,
-                ]
-            )
-
-        except Exception as e:
-            errors.append([f, x, e] + sheet.row_values(x))
-    return out, errors
-
-
-def import_raw_xlsx():
-    fields = [
-        'la_code',
-        'ba_ref',
-        'prop_empty:boolean',
-        'prop_empty_date:date~make_date_YYYY_MM_DD',
-        'prop_occupied:boolean',
-        'prop_occupied_date:date',
-        'prop_ba_rates:numeric',
-        'tenant',
+def convert_row(row, la, date_mode):
+    ''' Returns the validated values of a spreadsheet row '''
+    return [
+        make_la_code(row, 0, la),
+        make_ba_ref(row, 1, la),
+        make_bool(row, 2),
+        make_date(row, 3, date_mode),
+        make_bool(row, 4),
+        make_date(row, 5, date_mode),
+        make_number(row, 6),
+        row[7].value,
     ]
 
-    files = [f for f in listdir(DIR) if isfile(join(DIR, f))]
 
+def load_workbook(f):
+    ''' Validate the rows of a council spreadsheet, named <source>_<la>.xlsx,
+    and copy them into the staging table a batch at a time.  Rows that fail
+    go to import_errors.  Returns (file, rows loaded, rows rejected). '''
+    fields = process_header(staging_fields)
+    la = f.split('.')[0].split('_')[1]
+    loaded = 0
+    rejected = 0
+    rows = []
+    errors = []
+    book = xlrd.open_workbook(join(DIR, f), on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        # skip the header
+        for x in xrange(1, sheet.nrows):
+            try:
+                values = convert_row(sheet.row(x), la, book.datemode)
+            except Exception as e:
+                errors.append((x + 1, None, e, [f] + sheet.row_values(x)))
+            else:
+                rows.append([f, x + 1] + values)
+            if len(rows) + len(errors) >= config.BATCH_SIZE:
+                if rows:
+                    copy_rows(STAGING_TABLE, fields, rows)
+                if errors:
+                    import_errors.save_errors(STAGING_TABLE, errors)
+                loaded += len(rows)
+                rejected += len(errors)
+                rows = []
+                errors = []
+    finally:
+        book.release_resources()
+    if rows:
+        copy_rows(STAGING_TABLE, fields, rows)
+    if errors:
+        import_errors.save_errors(STAGING_TABLE, errors)
+    return f, loaded + len(rows), rejected + len(errors)
 
-    with open('vacancy_errors.csv', 'w') as fe:
-        with open('vacancy.csv', 'w') as fp:
-            a = csv.writer(fp, delimiter=',')
-            e = csv.writer(fe, delimiter=',')
-            a.writerows([fields])
-            e.writerows([['file', 'line', 'error'] + fields])
-            for f in files:
-                out, errors = process(f)
-                a.writerows(out)
-                e.writerows(errors)
 
 sql = '''
 DROP TABLE vacancy_updates;
@@ -169,405 +173,618 @@ DROP TABLE vacancy_info CASCADE;
 '''
 #run_sql(sql)
 
-sql = '''
-    CREATE TABLE IF NOT EXISTS vacancy_updates (
-        la_code text NOT NULL,
-        ba_ref text NOT NULL,
-        uarn bigint,
-        prop_empty boolean,
-        prop_empty_date date,
-        prop_occupied boolean,
-        prop_occupied_date date,
-        prop_ba_rates numeric,
-        tenant text,
-        postcode text,
-        last_updated timestamp
-    );
-
-    CREATE TABLE IF NOT EXISTS vacancy_info (
-        la_code text NOT NULL,
-        uarn bigint,
-        prop_empty boolean,
-        real_data boolean,
-        prop_occupied_date date,
-        prop_empty_date date,
-        tenant text,
-        last_updated timestamp
-    );
-
-do
-$$
-begin
-if not exists (
-    select indexname
-        from pg_indexes
-    where
-        tablename = 'vacancy_info'
-        and indexname = 'vacancy_info_uarn'
-)
-then
-    create index vacancy_info_uarn on vacancy_info (uarn);
-end if;
-end
-$$;
-
-do
-$$
-begin
-if not exists (
-    select indexname
-        from pg_indexes
-    where
-        tablename = 'vacancy_updates'
-        and indexname = 'vacancy_updates_ba_ref'
-)
-then
-    create index vacancy_updates_ba_ref on vacancy_updates (ba_ref);
-end if;
-end
-$$;
-
-do
-$$
-begin
-if not exists (
-    select indexname
-        from pg_indexes
-    where
-        tablename = 'vao_list_raw'
-        and indexname = 'vao_base_ba_ref'
-)
-then
-    create index vao_base_ba_ref on vao_list_raw (ba_ref);
-end if;
-end
-$$;
-
-do
-$$
-begin
-if not exists (
-    select indexname
-        from pg_indexes
-    where
-        tablename = 'vacancy_updates'
-        and indexname = 'vacancy_updates_uarn'
-)
-then
-    create index vacancy_updates_uarn on vacancy_updates (uarn);
-end if;
-end
-$$;
-'''
-run_sql(sql)
-
-sql = '''
-    CREATE OR REPLACE VIEW v_vacancy_stats AS
-    SELECT
-    la_code,
-    count(uarn) premisis_count,
-    count(nullif(real_data, false)) real_count,
-    100 * count(nullif(prop_empty, false)) / count(uarn) percent_empty,
-    count(nullif(prop_empty, false)) empty_count,
-    100 * count(nullif(real_data, false)) / count(uarn) percent_real
-    FROM vacancy_info
-    GROUP BY la_code
-    ORDER BY la_code
-'''
-
-run_sql(sql)
-
-
-# import_raw_xlsx()
 
-
-def make_date_c(v):
-    return datetime.strptime(v.split(' ')[0], '%Y-%m-%d')
-
-
-def make_bool_c(v):
-    return v == 'True'
-
-
-def make_number_c(v):
-    return Decimal(v)
-
-
-def make_text_c(v):
-    return v
-
-
-def get_uarn(la_code='', ba_ref=''):
+def create_tables():
     sql = '''
-    SELECT uarn FROM vao_list
-    WHERE trim(leading '0' from ba_ref)=:ba_ref
+        CREATE TABLE IF NOT EXISTS vacancy_updates (
+            la_code text NOT NULL,
+            ba_ref text NOT NULL,
+            uarn bigint,
+            prop_empty boolean,
+            prop_empty_date date,
+            prop_occupied boolean,
+            prop_occupied_date date,
+            prop_ba_rates numeric,
+            tenant text,
+            postcode text,
+            last_updated timestamp,
+            ba_ref_norm text,
+            matched timestamp
+        );
+
+        CREATE TABLE IF NOT EXISTS vacancy_info (
+            la_code text NOT NULL,
+            uarn bigint,
+            prop_empty boolean,
+            real_data boolean,
+            prop_occupied_date date,
+            prop_empty_date date,
+            tenant text,
+            last_updated timestamp,
+            updates bigint
+        );
+
+    do
+    $$
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vacancy_info'
+            and indexname = 'vacancy_info_uarn'
+    )
+    then
+        create index vacancy_info_uarn on vacancy_info (uarn);
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vacancy_updates'
+            and indexname = 'vacancy_updates_ba_ref'
+    )
+    then
+        create index vacancy_updates_ba_ref on vacancy_updates (ba_ref);
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vao_list_raw'
+            and indexname = 'vao_base_ba_ref'
+    )
+    then
+        create index vao_base_ba_ref on vao_list_raw (ba_ref);
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vacancy_updates'
+            and indexname = 'vacancy_updates_uarn'
+    )
+    then
+        create index vacancy_updates_uarn on vacancy_updates (uarn);
+    end if;
+    end
+    $$;
     '''
-    if la_code:
-        sql += '''
-            AND la_code=:la_code
-            '''
-    if la_code and ba_ref[0] not in '0123456789' and len(ba_ref) > 9:
-        count = 3
-    else:
-        count = 0
-    for x in range(count + 1):
-        result = run_sql(sql, ba_ref=ba_ref[x:].lstrip('0'), la_code=la_code)
-        for r in result:
-            return r[0]
-
+    run_sql(sql)
 
-def update_matches():
+    # ba_ref without leading zeros, which most matching strategies use, when
+    # each update was matched to a uarn and the number of updates for the LA
+    # vacancy_info was built from
     sql = '''
-    SELECT ba_ref, la_code FROM vacancy_updates
-    WHERE uarn is null
+    do
+    $$
+    begin
+    if not exists (
+        select column_name
+            from information_schema.columns
+        where
+            table_name = 'vacancy_updates'
+            and column_name = 'ba_ref_norm'
+    )
+    then
+        alter table vacancy_updates add column ba_ref_norm text;
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select column_name
+            from information_schema.columns
+        where
+            table_name = 'vacancy_updates'
+            and column_name = 'matched'
+    )
+    then
+        alter table vacancy_updates add column matched timestamp;
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select column_name
+            from information_schema.columns
+        where
+            table_name = 'vacancy_info'
+            and column_name = 'updates'
+    )
+    then
+        alter table vacancy_info add column updates bigint;
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vacancy_updates'
+            and indexname = 'vacancy_updates_ba_ref_norm'
+    )
+    then
+        create index vacancy_updates_ba_ref_norm
+        on vacancy_updates (ba_ref_norm);
+    end if;
+    end
+    $$;
+
+    do
+    $$
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vacancy_updates'
+            and indexname = 'vacancy_updates_la_code_ba_ref'
+    )
+    then
+        create unique index vacancy_updates_la_code_ba_ref
+        on vacancy_updates (la_code, ba_ref);
+    end if;
+    end
+    $$;
     '''
-    result = run_sql(sql)
-    count = 0
-    match = 0
-    for row in result:
-        uarn = get_uarn(row[1], row[0])
-        if uarn:
-            sql = '''
-            UPDATE vacancy_updates SET uarn = :uarn
-            WHERE ba_ref = :ba_ref AND la_code = :la_code
-            '''
-            run_sql(sql, ba_ref=row[0], la_code=row[1], uarn=uarn)
-            match += 1
-        count += 1
-        if count % 100 == 0:
-            print count, match
-    print count, match
-
-
-def update_matches_wrong_la():
+    run_sql(sql)
+
+    # the matching strategies compare vao ba_refs without leading zeros or
+    # by their ending, these indexes let them look the refs up.  They are
+    # lost when vao_list_raw is reimported so are checked on every run, the
+    # table is analyzed for the expression statistics when they are made.
     sql = '''
-    SELECT ba_ref FROM vacancy_updates
-    WHERE uarn is null
+    do
+    $$
+    declare
+        created boolean := false;
+    begin
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vao_list_raw'
+            and indexname = 'vao_list_raw_ba_ref_norm'
+    )
+    then
+        create index vao_list_raw_ba_ref_norm
+        on vao_list_raw (ltrim(ba_ref, '0'));
+        created := true;
+    end if;
+    if not exists (
+        select indexname
+            from pg_indexes
+        where
+            tablename = 'vao_list_raw'
+            and indexname = 'vao_list_raw_ba_ref_reverse'
+    )
+    then
+        create index vao_list_raw_ba_ref_reverse
+        on vao_list_raw (reverse(ba_ref) text_pattern_ops);
+        created := true;
+    end if;
+    if created then
+        analyze vao_list_raw;
+    end if;
+    end
+    $$;
     '''
-    result = run_sql(sql)
-    count = 0
-    match = 0
-    for row in result:
-        print count, match
-        uarn = get_uarn(ba_ref=row[0])
-        if uarn:
-         #   sql = '''
-         #   UPDATE vacancy_updates SET uarn = :uarn
-         #   WHERE ba_ref = :ba_ref AND la_code = :la_code
-         #   '''
-         #   run_sql(sql, ba_ref=row[0], la_code=row[1], uarn=uarn)
-            match += 1
-        count += 1
-        if count % 100 == 0:
-            print count, match
-    print count, match
-
-
-def update_vacancies():
-    data = {}
-    fields = [
-        ('prop_empty', make_bool_c),
-        ('prop_empty_date', make_date_c),
-        ('prop_occupied', make_bool_c),
-        ('prop_occupied_date', make_date_c),
-        ('prop_ba_rates', make_number_c),
-        ('tenant', make_text_c),
-    ]
-
-    with open('vacancy.csv') as f:
-        rows = csv.reader(f, delimiter=',')
-        count = 0
-        for row in rows:
-            count += 1
-            if count == 1:
-                continue
-        #    if count == 100:
-        #        break
-            sql = '''
-            SELECT uarn FROM vacancy_updates
-            WHERE ba_ref=:ba_ref AND la_code=:la_code
-            '''
-            result = run_sql(sql, ba_ref=row[1], la_code=row[0])
-            exists = False
-            uarn = None
-            for r in result:
-                exists = True
-                uarn = r[0]
-
-            if not exists:
-                sql = '''
-                INSERT INTO vacancy_updates (ba_ref, la_code)
-                VALUES (:ba_ref, :la_code)
-                '''
-                result = run_sql(sql, ba_ref=row[1], la_code=row[0])
-
-            updates = {}
-          #  if not uarn:
-          #      uarn = get_uarn(la_code=row[0], ba_ref=row[1])
-          #      if uarn:
-          #          updates['uarn'] = uarn
-
-            for i in range(6):
-                if row[i + 2].strip():
-                    updates[fields[i][0]] = fields[i][1](row[i + 2])
-            if updates:
-                updates['last_updated'] = datetime.now()
-            params = ' ,'.join(['%s = :%s' % (k, k) for k in updates.keys()])
-            sql = '''
-            UPDATE vacancy_updates SET %s
-            WHERE ba_ref = :ba_ref AND la_code = :la_code
-            ''' % (params)
-            run_sql(sql, ba_ref=row[1], la_code=row[0], **updates)
-            if count % 100 == 0:
-                print count - 1, len(data)
-
-
-def match_uarn():
-
-
-    sql = """
-UPDATE vacancy_updates
-SET uarn=subquery.uarn
-FROM (
-
-    SELECT b.uarn, b.ba_ref, b.la_code
-    FROM vao_list b
-    JOIN vacancy_updates v
-    ON trim(leading '0' from v.ba_ref) = trim(leading '0' from b.ba_ref)
-    WHERE v.uarn is null
-
-) AS subquery
-WHERE vacancy_updates.ba_ref=subquery.ba_ref
-AND vacancy_updates.la_code=subquery.la_code;
-    """
     run_sql(sql)
 
-    sql = """
-UPDATE vacancy_updates
-SET uarn=subquery.uarn
-FROM (
-
-    SELECT b.uarn, v.ba_ref, v.la_code
-    FROM vao_list b
-    JOIN vacancy_updates v
-    ON ltrim(ltrim(v.ba_ref, 'N'''), '0') = ltrim(b.ba_ref, '0')
-    AND b.la_code = v.la_code
-    WHERE v.uarn is null
-    ORDER BY uarn
+    create_views()
 
 
-) AS subquery
-WHERE vacancy_updates.ba_ref=subquery.ba_ref
-AND vacancy_updates.la_code=subquery.la_code;
-    """
+def create_views():
+    sql = '''
+        CREATE OR REPLACE VIEW v_vacancy_stats AS
+        SELECT
+        la_code,
+        count(uarn) premisis_count,
+        count(nullif(real_data, false)) real_count,
+        100 * count(nullif(prop_empty, false)) / count(uarn) percent_empty,
+        count(nullif(prop_empty, false)) empty_count,
+        100 * count(nullif(real_data, false)) / count(uarn) percent_real
+        FROM vacancy_info
+        GROUP BY la_code
+        ORDER BY la_code
+    '''
     run_sql(sql)
 
 
+STAGING_TABLE = 'vacancy_staging'
+
+staging_fields = [
+    'source',
+    'line:bigint',
+    'la_code',
+    'ba_ref',
+    'prop_empty',
+    'prop_empty_date',
+    'prop_occupied',
+    'prop_occupied_date',
+    'prop_ba_rates',
+    'tenant',
+]
+
+# LAs whose references are the end of the VOA ba_ref
+RIGHT_SUFFIX_LAS = [
+    'E07000195', 'W06000006', 'E07000085', 'E07000087',
+    'E06000056', 'E07000089', 'E06000043', 'E07000099',
+    'E06000034', 'E07000203', 'E07000102', 'E07000117',
+    'E07000135', 'W06000004', 'E07000193', 'W06000011',
+    'W06000013', 'W06000024', 'E07000200', 'E07000067',
+    'E07000032', 'E07000080', 'W06000003',
+]
+
+# (name, join condition of vacancy_updates v to vao_list b) tried in order
+# on the rows still without a uarn.  The vao side of each condition is
+# written to match one of the vao_list_raw indexes from create_tables, the
+# suffix match is a range on the reversed ref.
+MATCH_STRATEGIES = [
+    ('exact', """
+        b.la_code = v.la_code
+        AND b.ba_ref = v.ba_ref
+    """),
+    ('leading_zeros', """
+        b.la_code = v.la_code
+        AND ltrim(b.ba_ref, '0') = v.ba_ref_norm
+    """),
+    ('n_prefix', """
+        b.la_code = v.la_code
+        AND ltrim(b.ba_ref, '0') = ltrim(ltrim(v.ba_ref, 'N'''), '0')
+    """),
+    ('skip_prefix', """
+        b.la_code = v.la_code
+        AND v.ba_ref ~ '^[^0-9]'
+        AND length(v.ba_ref) > 9
+        AND ltrim(b.ba_ref, '0') IN (
+            ltrim(substr(v.ba_ref, 2), '0'),
+            ltrim(substr(v.ba_ref, 3), '0'),
+            ltrim(substr(v.ba_ref, 4), '0')
+        )
+    """),
+    ('right_suffix', """
+        b.la_code = v.la_code
+        AND length(v.ba_ref) > 6
+        AND v.la_code IN ({las})
+        {{suffix_range}}
+        AND v.ba_ref = right(b.ba_ref, length(v.ba_ref))
+    """.format(las=', '.join(["'%s'" % la for la in RIGHT_SUFFIX_LAS]))),
+]
+
+
+def suffix_range():
+    ''' Condition limiting the right_suffix match to a range of the
+    reversed vao refs, the upper bound is the last character of the
+    database encoding.  With multibyte encodings other than UTF8 there is
+    no such character that chr() will make so no range is used. '''
+    sql = '''
+        SELECT current_setting('server_encoding'),
+        pg_encoding_max_length(
+            pg_char_to_encoding(current_setting('server_encoding'))
+        )
+    '''
+    encoding, max_length = run_sql(sql).first()
+    if encoding == 'UTF8':
+        last = 'chr(1114111)'
+    elif max_length == 1:
+        last = 'chr(255)'
+    else:
+        return ''
+    return '''
+        AND reverse(b.ba_ref) ~>=~ reverse(v.ba_ref)
+        AND reverse(b.ba_ref) ~<~ (reverse(v.ba_ref) || {last})
+    '''.format(last=last)
+
+
+def load_vacancies(workers=None, verbose=0):
+    ''' Load the council spreadsheets into the staging table, several at a
+    time, and merge it into vacancy_updates.  Values that are blank leave
+    the existing value, if a reference appears more than once its last line
+    is used. '''
+    fields = process_header(staging_fields)
+    create_table(STAGING_TABLE, fields, unlogged=True)
+    # the workers save their bad rows, the table must exist before they
+    # start so that they do not all try to create it
+    import_errors._init()
+    import_errors.clear_errors(STAGING_TABLE)
+    files = sorted([f for f in listdir(DIR) if isfile(join(DIR, f))])
+    if workers is None:
+        workers = config.IMPORT_WORKERS
+    workers = min(workers, len(files))
+    pool = None
+    if workers > 1:
+        pool = make_pool(workers)
+        results = pool.imap_unordered(load_workbook, files)
+    else:
+        results = itertools.imap(load_workbook, files)
+    loaded = 0
+    rejected = 0
+    try:
+        for f, rows, errors in results:
+            if verbose:
+                print('{file}: {rows:,} rows, {errors:,} errors'.format(
+                    file=f, rows=rows, errors=errors
+                ))
+            loaded += rows
+            rejected += errors
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if verbose:
+        print('{loaded:,} vacancy lines loaded, {rejected:,} rejected'.format(
+            loaded=loaded, rejected=rejected
+        ))
 
-    sql = """
-UPDATE vacancy_updates
-SET uarn=subquery.uarn
-FROM (
-
- SELECT b.uarn, v.ba_ref, v.la_code
-FROM vacancy_updates v
-JOIN vao_list b
-ON v.ba_ref = right(b.ba_ref, length(v.ba_ref))
-AND b.la_code = v.la_code
-WHERE v.uarn is null
-AND length(v.ba_ref) > 6
-AND v.la_code in
-('E07000195', 'W06000006', 'E07000085', 'E07000087',
-'E06000056', 'E07000089', 'E06000043', 'E07000099',
-'E06000034', 'E07000203', 'E07000102', 'E07000117',
-'E07000135', 'W06000004', 'E07000193', 'W06000011',
-'W06000013', 'W06000024', 'E07000200', 'E07000067',
-'E07000032', 'E07000080', 'W06000003')
-
-) AS subquery
-WHERE vacancy_updates.ba_ref=subquery.ba_ref
-AND vacancy_updates.la_code=subquery.la_code;
-    """
+    sql = '''
+        INSERT INTO vacancy_updates (la_code, ba_ref, ba_ref_norm)
+        SELECT DISTINCT s.la_code, s.ba_ref, ltrim(s.ba_ref, '0')
+        FROM {staging} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM vacancy_updates u
+            WHERE u.la_code = s.la_code AND u.ba_ref = s.ba_ref
+        );
+
+        UPDATE vacancy_updates SET ba_ref_norm = ltrim(ba_ref, '0')
+        WHERE ba_ref_norm IS NULL;
+
+        UPDATE vacancy_updates u SET
+        prop_empty = coalesce(
+            nullif(trim(s.prop_empty), '')::boolean, u.prop_empty),
+        prop_empty_date = coalesce(
+            split_part(nullif(trim(s.prop_empty_date), ''), ' ', 1)::date,
+            u.prop_empty_date),
+        prop_occupied = coalesce(
+            nullif(trim(s.prop_occupied), '')::boolean, u.prop_occupied),
+        prop_occupied_date = coalesce(
+            split_part(nullif(trim(s.prop_occupied_date), ''), ' ', 1)::date,
+            u.prop_occupied_date),
+        prop_ba_rates = coalesce(
+            nullif(trim(s.prop_ba_rates), '')::numeric, u.prop_ba_rates),
+        tenant = CASE WHEN trim(s.tenant) != ''
+            THEN s.tenant ELSE u.tenant END,
+        last_updated = CASE WHEN trim(concat(
+                s.prop_empty, s.prop_empty_date, s.prop_occupied,
+                s.prop_occupied_date, s.prop_ba_rates, s.tenant
+            )) != ''
+            THEN LOCALTIMESTAMP ELSE u.last_updated END
+        FROM (
+            SELECT DISTINCT ON (la_code, ba_ref) *
+            FROM {staging}
+            ORDER BY la_code, ba_ref, source DESC, line DESC
+        ) s
+        WHERE u.la_code = s.la_code AND u.ba_ref = s.ba_ref;
+    '''.format(staging=STAGING_TABLE)
     run_sql(sql)
 
 
-def info_table():
-
+def match_uarns(verbose=0):
+    ''' Find the uarn of unmatched vacancies with each strategy in turn,
+    returns a list of (strategy, rows matched) '''
     sql = '''
-    SELECT code FROM c_la
+        UPDATE vacancy_updates u
+        SET uarn = m.uarn, matched = LOCALTIMESTAMP
+        FROM (
+            SELECT DISTINCT ON (v.la_code, v.ba_ref)
+                v.la_code, v.ba_ref, b.uarn
+            FROM vacancy_updates v
+            JOIN vao_list b ON {condition}
+            WHERE v.uarn IS NULL
+            ORDER BY v.la_code, v.ba_ref, b.uarn
+        ) m
+        WHERE u.la_code = m.la_code AND u.ba_ref = m.ba_ref
     '''
+    matches = []
+    range_ = suffix_range()
+    for name, condition in MATCH_STRATEGIES:
+        condition = condition.format(suffix_range=range_)
+        result = run_sql(sql.format(condition=condition))
+        matches.append((name, result.rowcount))
+    if verbose:
+        match_report(matches)
+    return matches
+
+
+def match_report(matches):
+    sql = '''
+        SELECT count(*), count(uarn) FROM vacancy_updates
+    '''
+    total, matched = run_sql(sql).first()
+    # references that only match premises in a different LA
+    sql = '''
+        SELECT count(DISTINCT (v.la_code, v.ba_ref))
+        FROM vacancy_updates v
+        JOIN vao_list b ON ltrim(b.ba_ref, '0') = v.ba_ref_norm
+        WHERE v.uarn IS NULL
+    '''
+    other_la = run_sql(sql).scalar()
+
+    def line(name, count):
+        percent = 100.0 * count / total if total else 0
+        print('{name:<16}{count:>10,}{percent:>8.1f}%'.format(
+            name=name, count=count, percent=percent
+        ))
+
+    print('{total:,} vacancy references'.format(total=total))
+    line('matched before', matched - sum([m[1] for m in matches]))
+    for name, count in matches:
+        line(name, count)
+    line('unmatched', total - matched)
+    line('  other la', other_la)
+
+
+INFO_TABLE = 'vacancy_info'
+
+# one row per premises of each LA in c_la.  Premises with vacancy data
+# take it from their latest update, the rest get the LA default: not
+# empty if the LA only reports empty premises, empty if it only reports
+# occupied ones, otherwise unknown.
+info_sql = '''
+    WITH defaults AS (
+        SELECT la_code,
+        count(*) AS updates,
+        CASE
+            WHEN count(*) FILTER (WHERE prop_empty) = count(*) THEN false
+            WHEN count(*) FILTER (WHERE prop_empty) = 0 THEN true
+        END AS prop_empty
+        FROM vacancy_updates
+        GROUP BY la_code
+    ), updates AS (
+        SELECT DISTINCT ON (la_code, uarn)
+            la_code, uarn, prop_empty, prop_occupied_date,
+            prop_empty_date, tenant
+        FROM vacancy_updates
+        WHERE uarn IS NOT NULL
+        ORDER BY la_code, uarn, last_updated DESC NULLS LAST
+    )
+    SELECT
+        l.la_code,
+        l.uarn,
+        CASE WHEN u.uarn IS NULL
+            THEN d.prop_empty ELSE u.prop_empty END AS prop_empty,
+        u.uarn IS NOT NULL AS real_data,
+        u.prop_occupied_date,
+        u.prop_empty_date,
+        u.tenant,
+        LOCALTIMESTAMP AS last_updated,
+        coalesce(d.updates, 0) AS updates
+    FROM vao_list l
+    JOIN c_la c ON c.code = l.la_code
+    LEFT JOIN defaults d ON d.la_code = l.la_code
+    LEFT JOIN updates u ON u.la_code = l.la_code AND u.uarn = l.uarn
+    {where}
+'''
 
-    results = run_sql(sql)
-
-    for row in results:
-        la_code = row[0]
-
-        print(la_code)
-        sql = '''
-        DELETE FROM vacancy_info
-        WHERE la_code=:la_code
-        '''
-        data = run_sql(sql, la_code=la_code)
-
-        sql = '''
-        INSERT INTO vacancy_info (la_code, uarn)
-        SELECT la_code, uarn from vao_list
-        WHERE la_code=:la_code
-        '''
-        data = run_sql(sql, la_code=la_code)
-
-        sql = '''
-        SELECT DISTINCT prop_empty
-        FROM vacancy_updates where la_code=:la_code
-        '''
-
-        data = run_sql(sql, la_code=la_code)
-        default_empty = None
-        for d in data:
-            if default_empty:
-                default_empty = None
-                break
-            else:
-                default_empty = not d[0]
 
+def changed_las():
+    ''' LAs whose vacancy updates have been added, changed, matched or
+    deleted since vacancy_info was built.  Returns None if vao_list or
+    c_la have been updated since then as every LA needs rebuilding. '''
+    if 'table_summaries' in table_list():
         sql = '''
-        UPDATE vacancy_info
-        SET
-        prop_empty = :default_empty,
-        real_data = false
-        WHERE la_code = :la_code
+            SELECT (
+                SELECT max(updated) FROM table_summaries
+                WHERE name IN ('vao_list', 'vao_list_raw', 'c_la')
+            ) > (
+                SELECT min(last_updated) FROM vacancy_info
+            )
         '''
-
-        run_sql(sql, la_code=la_code, default_empty=default_empty)
-
-        sql = '''
-        UPDATE vacancy_info vi
-        SET
-        prop_empty=v.prop_empty,
-        prop_occupied_date=v.prop_occupied_date,
-        prop_empty_date=v.prop_empty_date,
-        tenant=v.tenant,
-        real_data = true
+        if run_sql(sql).scalar():
+            return None
+    sql = '''
+        SELECT coalesce(u.la_code, i.la_code)
         FROM (
-            SELECT
-                uarn,
-                prop_empty,
-                prop_occupied_date,
-                prop_empty_date,
-                tenant
+            SELECT la_code, count(*) AS updates,
+            max(greatest(last_updated, matched)) AS changed
             FROM vacancy_updates
-            WHERE la_code = :la_code
-        ) AS v
-        WHERE vi.uarn = v.uarn
-        '''
-
-        run_sql(sql, la_code=la_code)
-        print('done')
-#import_raw_xlsx()
-#update_vacancies()
-#match_uarn()
-#update_matches()
-#update_matches_wrong_la()
-
-
-info_table()
+            WHERE la_code IN (SELECT code FROM c_la)
+            GROUP BY la_code
+        ) u
+        FULL JOIN (
+            SELECT la_code, max(updates) AS updates,
+            min(last_updated) AS built
+            FROM vacancy_info
+            GROUP BY la_code
+        ) i ON i.la_code = u.la_code
+        WHERE coalesce(u.updates, 0) != coalesce(i.updates, 0)
+        OR u.changed > i.built
+    '''
+    return [row[0] for row in run_sql(sql)]
+
+
+def info_table(incremental=False, verbose=0):
+    ''' Rebuild vacancy_info.  A full rebuild creates a new table in one
+    query and swaps it in, incremental just replaces the rows of the LAs
+    that have changed. '''
+    las = None
+    if incremental and INFO_TABLE in table_list():
+        las = changed_las()
+    if las is not None:
+        if verbose:
+            print('updating vacancy_info for %s LAs' % len(las))
+        if not las:
+            return
+        sql = '''
+            BEGIN;
+            DELETE FROM {table} WHERE la_code = ANY(:las);
+            INSERT INTO {table} (
+                la_code, uarn, prop_empty, real_data, prop_occupied_date,
+                prop_empty_date, tenant, last_updated, updates
+            )
+            {info_sql};
+            COMMIT;
+        '''.format(
+            table=quote(INFO_TABLE),
+            info_sql=info_sql.format(where='WHERE l.la_code = ANY(:las)'),
+        )
+        run_sql(sql, las=las)
+        return
+
+    temp_table = config.TEMP_TABLE_STR + INFO_TABLE
+    sql = '''
+        DROP TABLE IF EXISTS {table};
+        CREATE TABLE {table} AS
+        {info_sql};
+        ALTER TABLE {table} ALTER COLUMN la_code SET NOT NULL;
+        CREATE INDEX {index} ON {table} (uarn);
+        CREATE INDEX {la_index} ON {table} (la_code);
+    '''.format(
+        table=quote(temp_table),
+        info_sql=info_sql.format(where=''),
+        index=quote(temp_table + '_uarn'),
+        la_index=quote(temp_table + '_la_code'),
+    )
+    run_sql(sql)
+    # the catalog may have been loaded before the temp table existed
+    sa_util.catalog.invalidate()
+    # the swap drops the views on vacancy_info so they are made again
+    swap_tables(verbose=verbose, force=True, tables=[INFO_TABLE])
+    create_views()
+    recreate_dependent_views([INFO_TABLE], verbose=verbose)
+
+
+def main(verbose=1, incremental=False):
+    create_tables()
+    load_vacancies(verbose=verbose)
+    match_uarns(verbose=verbose)
+    info_table(incremental=incremental, verbose=verbose)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Import vacancy data')
+    parser.add_argument('-v', '--verbose', action='count', default=1)
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only rebuild vacancy_info for changed LAs')
+    args = parser.parse_args()
+    main(verbose=args.verbose, incremental=args.incremental)
@@ -0,0 +1,220 @@
+import multiprocessing
+import Queue
+import time
+import traceback
+
+import config
+import sa_util
+
+# seconds between checks that the pool workers are still alive
+POLL_INTERVAL = 5
+
+
+def _init_worker():
+    sa_util.reset_engine()
+
+
+def _run_job(job):
+    name, fn, args, kw = job
+    # the catalog may be stale after jobs in other processes
+    sa_util.catalog.invalidate()
+    try:
+        fn(*args, **kw)
+    except Exception:
+        return name, traceback.format_exc()
+    return name, None
+
+
+def _time_job(job):
+    start = time.time()
+    name, error = _run_job(job)
+    return name, error, time.time() - start
+
+
+def format_time(seconds):
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return "%d:%02d:%02d" % (h, m, s)
+
+
+def make_pool(workers):
+    ''' Create a process pool where each worker has its own engine '''
+    sa_util.dispose_engine()
+    pool = multiprocessing.Pool(workers, initializer=_init_worker)
+    sa_util.reset_engine()
+    pool.worker_pids = worker_pids(pool)
+    return pool
+
+
+def worker_pids(pool):
+    return set([process.pid for process in pool._pool])
+
+
+def workers_died(pool):
+    ''' True if a worker has died since the pool was made.  The pool
+    replaces dead workers but the job one was running never completes. '''
+    return worker_pids(pool) != pool.worker_pids
+
+
+def run_jobs(jobs, workers=None, verbose=0):
+    ''' Run independent jobs, a list of (name, fn, args, kw), across a
+    process pool.  Returns a dict of name: traceback for failed jobs. '''
+    if workers is None:
+        workers = config.IMPORT_WORKERS
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        results = [_run_job(job) for job in jobs]
+    else:
+        if verbose:
+            print('running %s jobs on %s workers' % (len(jobs), workers))
+        pool = make_pool(workers)
+        try:
+            result = pool.map_async(_run_job, jobs, chunksize=1)
+            while not result.ready():
+                result.wait(POLL_INTERVAL)
+                if not result.ready() and workers_died(pool):
+                    pool.terminate()
+                    raise Exception('worker process died')
+            results = result.get()
+        finally:
+            pool.close()
+            pool.join()
+            sa_util.catalog.invalidate()
+    errors = {}
+    for name, error in results:
+        if error:
+            errors[name] = error
+    return errors
+
+
+def raise_errors(errors):
+    if not errors:
+        return
+    for name in sorted(errors):
+        print('failed %s' % name)
+        print(errors[name])
+    raise Exception('Failed: %s' % ', '.join(sorted(errors)))
+
+
+def critical_path(dependencies, timings):
+    ''' Returns (total time, names) of the slowest dependency chain '''
+    finish = {}
+    previous = {}
+
+    def path_time(name):
+        if name not in finish:
+            slowest = None
+            for dep in dependencies.get(name, []):
+                if dep in timings and (slowest is None or
+                                       path_time(dep) > finish[slowest]):
+                    slowest = dep
+            previous[name] = slowest
+            finish[name] = timings[name]
+            if slowest:
+                finish[name] += finish[slowest]
+        return finish[name]
+
+    if not timings:
+        return 0, []
+    last = max(timings, key=path_time)
+    path = []
+    while last:
+        path.append(last)
+        last = previous[last]
+    path.reverse()
+    return finish[path[-1]], path
+
+
+def run_graph(jobs, dependencies, workers=None, verbose=0):
+    ''' Run jobs, a list of (name, fn, args, kw), starting each one as soon
+    as all of its dependencies have completed with up to workers running at
+    once.  dependencies is a dict of name: names that must be run first.
+    Jobs that depend on a failed job are not run.  Returns a dict of
+    name: error for the jobs that failed or were skipped. '''
+    if workers is None:
+        workers = config.BUILD_WORKERS
+    workers = max(workers, 1)
+    order = [job[0] for job in jobs]
+    rank = dict((name, i) for i, name in enumerate(order))
+    jobs = dict((job[0], job) for job in jobs)
+    waiting = {}
+    dependants = {}
+    for name in order:
+        waiting[name] = set(dependencies.get(name, [])) & set(order)
+        for dep in waiting[name]:
+            dependants.setdefault(dep, []).append(name)
+    ready = [name for name in order if not waiting[name]]
+
+    done = Queue.Queue()
+    pool = None
+    if workers > 1 and len(order) > 1:
+        if verbose:
+            print('building %s items on %s workers' % (len(order), workers))
+        pool = make_pool(workers)
+
+    errors = {}
+    timings = {}
+    running = 0
+    started = set()
+    aborted = False
+    start = time.time()
+    try:
+        while ready or running:
+            while ready and running < workers:
+                ready.sort(key=rank.get)
+                job = jobs[ready.pop(0)]
+                if pool:
+                    pool.apply_async(_time_job, [job], callback=done.put)
+                else:
+                    done.put(_time_job(job))
+                started.add(job[0])
+                running += 1
+            try:
+                name, error, elapsed = done.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                if not workers_died(pool):
+                    continue
+                # the running jobs cannot be told apart from the one that
+                # died so they all fail and nothing more is started
+                pool.terminate()
+                aborted = True
+                break
+            running -= 1
+            if error:
+                errors[name] = error
+                continue
+            timings[name] = elapsed
+            for dependant in dependants.get(name, []):
+                waiting[dependant].discard(name)
+                if not waiting[dependant]:
+                    ready.append(dependant)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+            sa_util.catalog.invalidate()
+
+    for name in order:
+        if name in timings or name in errors:
+            continue
+        if name in started:
+            errors[name] = 'worker process died, build aborted'
+        elif aborted:
+            errors[name] = 'skipped, build aborted'
+        else:
+            errors[name] = 'skipped, depends on %s' % ', '.join(
+                sorted(waiting[name])
+            )
+
+    if verbose:
+        total, path = critical_path(dependencies, timings)
+        print('built {count} items in {wall} (build time {busy})'.format(
+            count=len(timings),
+            wall=format_time(time.time() - start),
+            busy=format_time(sum(timings.values())),
+        ))
+        print('critical path {total}: {path}'.format(
+            total=format_time(total),
+            path=' -> '.join(path),
+        ))
+    return errors
@@ -0,0 +1,85 @@
+import unittest
+
+from munge.sa_common import Catalog
+
+
+class FakeEngine(object):
+    ''' Answers the catalog queries and counts them '''
+
+    def __init__(self):
+        self.results = {
+            Catalog.relations_sql: [
+                ('vao_list', 'r', True),
+                ('v_premises', 'v', True),
+                ('pg_stat_x', 'v', False),
+                ('vao_list_id_seq', 'S', True),
+            ],
+            Catalog.indexes_sql: [
+                ('vao_list', 'vao_list_pkey', True, True, ['id']),
+                ('vao_list', 'vao_list_uarn', False, False, ['uarn']),
+            ],
+            Catalog.columns_sql: [
+                ('vao_list', 'id', 'integer'),
+                ('vao_list', 'uarn', 'bigint'),
+                ('vao_list', 'area', 'double precision'),
+                ('v_premises', 'uarn', 'bigint'),
+            ],
+        }
+        self.queries = 0
+
+    def execute(self, sql):
+        self.queries += 1
+        return self.results[sql]
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.catalog = Catalog(self.engine)
+
+    def test_relations(self):
+        self.assertEqual(self.catalog.table_list(), ['vao_list'])
+        self.assertEqual(self.catalog.view_list(),
+                         ['v_premises', 'pg_stat_x'])
+        # system views are left out
+        self.assertEqual(self.catalog.table_view_list(),
+                         ['vao_list', 'v_premises'])
+        self.assertEqual(self.catalog.sequence_names(), ['vao_list_id_seq'])
+
+    def test_indexes(self):
+        self.assertEqual(self.catalog.get_primary_keys('vao_list'), ['id'])
+        self.assertEqual(self.catalog.get_pk_constraint('vao_list')['name'],
+                         'vao_list_pkey')
+        self.assertEqual(self.catalog.get_indexes('vao_list'), [{
+            'name': 'vao_list_uarn',
+            'column_names': ['uarn'],
+            'unique': False,
+        }])
+        self.assertEqual(self.catalog.get_primary_keys('v_premises'), [])
+        self.assertEqual(self.catalog.get_indexes('missing'), [])
+
+    def test_fields(self):
+        self.assertEqual(self.catalog.get_fields('vao_list'), [
+            {'name': 'id', 'type': 'integer', 'pk': True, 'indexed': False},
+            {'name': 'uarn', 'type': 'bigint', 'pk': False, 'indexed': True},
+            {'name': 'area', 'type': 'float', 'pk': False, 'indexed': False},
+        ])
+        self.assertEqual(self.catalog.get_fields('missing'), [])
+
+    def test_cached_until_invalidated(self):
+        self.catalog.table_list()
+        self.catalog.get_indexes('vao_list')
+        self.catalog.get_columns('vao_list')
+        self.catalog.get_columns('v_premises')
+        self.assertEqual(self.engine.queries, 3)
+        self.catalog.invalidate()
+        self.engine.results[Catalog.relations_sql].append(
+            ('s_summary', 'r', True)
+        )
+        self.assertEqual(self.catalog.table_list(), ['vao_list', 's_summary'])
+        self.assertEqual(self.engine.queries, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+from munge import checkpoints, sa_util
+
+
+class Scalar(object):
+
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeDatabase(object):
+    ''' Stands in for the sa_util functions checkpoints uses, keeping the
+    checkpoint rows and the row counts of the tables '''
+
+    def __init__(self):
+        self.tables = {}
+        self.checkpoints = {}
+
+    def table_list(self):
+        return list(self.tables)
+
+    def ensure_table(self, table, fields, verbose=0):
+        self.tables.setdefault(table, 0)
+
+    def run_sql(self, sql, **params):
+        if sql.startswith('DELETE'):
+            self.checkpoints.pop(params['name'], None)
+        elif 'INSERT' in sql:
+            self.checkpoints[params['name']] = params
+        elif 'count(*)' in sql:
+            return Scalar(self.tables[sql.split('"')[1]])
+        else:
+            checkpoint = self.checkpoints.get(params['name'])
+            if not checkpoint:
+                return []
+            return [[checkpoint[key] for key in
+                     ['target', 'spec', 'line', 'rows', 'errors']]]
+
+
+class CheckpointsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.saved = {}
+        for name in ['table_list', 'ensure_table', 'run_sql']:
+            self.saved[name] = getattr(sa_util, name)
+            setattr(sa_util, name, getattr(self.db, name))
+        checkpoints._initiated = False
+        self.db.tables['##_TEMP_##_vao'] = 200
+
+    def tearDown(self):
+        for name, fn in self.saved.items():
+            setattr(sa_util, name, fn)
+        checkpoints._initiated = False
+
+    def save(self, rows=200):
+        checkpoints.save_checkpoint('vao', '##_TEMP_##_vao', 'spec1',
+                                    line=250, rows=rows, errors=3)
+
+    def test_resumable(self):
+        self.save()
+        checkpoint = checkpoints.get_checkpoint('vao', 'spec1')
+        self.assertEqual(checkpoint, {
+            'target': '##_TEMP_##_vao',
+            'spec': 'spec1',
+            'line': 250,
+            'rows': 200,
+            'errors': 3,
+        })
+
+    def test_no_table(self):
+        self.assertEqual(checkpoints.get_checkpoint('vao', 'spec1'), None)
+        # clearing does not create the table
+        checkpoints.clear_checkpoint('vao')
+        self.assertFalse(checkpoints.TABLE in self.db.tables)
+
+    def test_cleared(self):
+        self.save()
+        checkpoints.clear_checkpoint('vao')
+        self.assertEqual(checkpoints.get_checkpoint('vao', 'spec1'), None)
+
+    def test_spec_changed(self):
+        self.save()
+        self.assertEqual(checkpoints.get_checkpoint('vao', 'spec2'), None)
+
+    def test_target_dropped(self):
+        self.save()
+        del self.db.tables['##_TEMP_##_vao']
+        self.assertEqual(checkpoints.get_checkpoint('vao', 'spec1'), None)
+
+    def test_rows_not_committed(self):
+        # the target holds rows written after the checkpoint
+        self.save(rows=150)
+        self.assertEqual(checkpoints.get_checkpoint('vao', 'spec1'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import sqlalchemy as sa
+
+from munge.code_cache import CodeCache
+
+
+class FakeDatabase(object):
+    ''' Answers the queries of CodeCache and counts them '''
+
+    def __init__(self):
+        self.versions = {'c_la': datetime.datetime(2016, 1, 1)}
+        self.codes = {'c_la': [('E1', 'Hartlepool'), ('E2', 'Middlesbrough')]}
+        self.queries = []
+
+    def run_sql(self, sql):
+        self.queries.append(sql)
+        if sql == CodeCache.versions_sql:
+            return self.versions.items()
+        table = sql.split('"')[-2]
+        if table not in self.codes:
+            raise sa.exc.DBAPIError(sql, {}, Exception('no table'))
+        return self.codes[table]
+
+
+class CodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.cache = CodeCache(self.db.run_sql, check_interval=0)
+
+    def test_get(self):
+        self.assertEqual(self.cache.get('la'),
+                         {'E1': 'Hartlepool', 'E2': 'Middlesbrough'})
+        self.assertEqual(self.cache.get('ba'), None)
+
+    def test_loaded_once(self):
+        self.cache.get('la')
+        self.cache.get('la')
+        loads = [q for q in self.db.queries if q != CodeCache.versions_sql]
+        self.assertEqual(len(loads), 1)
+
+    def test_reloaded_when_updated(self):
+        self.cache.get('la')
+        self.db.codes['c_la'] = [('E1', 'Hartlepool UA')]
+        self.assertEqual(self.cache.get('la')['E1'], 'Hartlepool')
+        self.db.versions['c_la'] = datetime.datetime(2016, 1, 2)
+        self.assertEqual(self.cache.get('la'), {'E1': 'Hartlepool UA'})
+
+    def test_check_interval(self):
+        cache = CodeCache(self.db.run_sql, check_interval=60)
+        cache.get('la')
+        cache.get('ba')
+        self.assertEqual(self.db.queries.count(CodeCache.versions_sql), 1)
+
+    def test_dropped_table(self):
+        self.db.versions['c_ba'] = datetime.datetime(2016, 1, 1)
+        self.assertEqual(self.cache.get('ba'), {})
+
+
+class CodeCacheFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = FakeDatabase()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def cache(self):
+        return CodeCache(self.db.run_sql, check_interval=0,
+                         path=os.path.join(self.path, 'codes'))
+
+    def test_shared_between_caches(self):
+        self.cache().get('la')
+        self.db.codes['c_la'] = []
+        # read from the file saved by the first cache
+        self.assertEqual(self.cache().get('la')['E1'], 'Hartlepool')
+
+    def test_older_versions_removed(self):
+        cache = self.cache()
+        cache.get('la')
+        old = self.db.versions['c_la']
+        new = datetime.datetime(2016, 1, 2)
+        # a newer version saved by another process is kept
+        newer = datetime.datetime(2016, 1, 3)
+        cache.save('c_la', newer, {})
+        self.db.versions['c_la'] = new
+        cache.get('la')
+        self.assertEqual(
+            sorted(os.listdir(cache.path)),
+            [os.path.basename(cache.filename('c_la', version))
+             for version in [new, newer]]
+        )
+        self.assertFalse(os.path.exists(cache.filename('c_la', old)))
+
+
+if __name__ == '__main__':
+    unittest.main()
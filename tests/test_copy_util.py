@@ -0,0 +1,193 @@
+import datetime
+import hashlib
+import struct
+import unittest
+from decimal import Decimal
+
+from munge import copy_util, sa_util
+
+
+class TextValueTest(unittest.TestCase):
+
+    def test_null_and_bool(self):
+        self.assertEqual(copy_util.text_value(None), '\\N')
+        self.assertEqual(copy_util.text_value(True), 't')
+        self.assertEqual(copy_util.text_value(False), 'f')
+
+    def test_escapes(self):
+        self.assertEqual(copy_util.text_value('a\tb\nc\\d\re'),
+                         'a\\tb\\nc\\\\d\\re')
+
+    def test_unicode_and_numbers(self):
+        self.assertEqual(copy_util.text_value(u'caf\xe9'), 'caf\xc3\xa9')
+        self.assertEqual(copy_util.text_value(u'caf\xe9', 'latin1'),
+                         'caf\xe9')
+        self.assertEqual(copy_util.text_value(0.1), '0.1')
+        self.assertEqual(copy_util.text_value(12), '12')
+
+    def test_buffer(self):
+        buf = copy_util.text_buffer([(1, None, u'x'), (2, True, 'y')])
+        self.assertEqual(buf.read(), '1\t\\N\tx\n2\tt\ty\n')
+
+    def test_buffer_encoding(self):
+        buf = copy_util.text_buffer([(u'\xe9',)], 'latin1')
+        self.assertEqual(buf.read(), '\xe9\n')
+
+
+class BinaryEncoderTest(unittest.TestCase):
+
+    def encode(self, type_, value):
+        encoder, = copy_util.binary_encoders([type_])
+        return encoder(value)
+
+    def test_integers(self):
+        self.assertEqual(self.encode('smallint', '7'), struct.pack('>h', 7))
+        self.assertEqual(self.encode('integer', -2), struct.pack('>i', -2))
+        self.assertEqual(self.encode('bigint', 2 ** 40),
+                         struct.pack('>q', 2 ** 40))
+
+    def test_float(self):
+        self.assertEqual(self.encode('float', '1.5'), struct.pack('>d', 1.5))
+
+    def test_bool(self):
+        self.assertEqual(self.encode('boolean', True), '\x01')
+        self.assertEqual(self.encode('boolean', 'Yes'), '\x01')
+        self.assertEqual(self.encode('boolean', 'n'), '\x00')
+
+    def test_text(self):
+        self.assertEqual(self.encode('text', u'caf\xe9'), 'caf\xc3\xa9')
+        self.assertEqual(self.encode('text', 12), '12')
+        encoder, = copy_util.binary_encoders(['text'], 'latin1')
+        self.assertEqual(encoder(u'caf\xe9'), 'caf\xe9')
+
+    def test_date(self):
+        # days since 2000-01-01
+        self.assertEqual(self.encode('date', datetime.date(2000, 1, 2)),
+                         struct.pack('>i', 1))
+        self.assertEqual(self.encode('date', '1999-12-31'),
+                         struct.pack('>i', -1))
+        self.assertEqual(
+            self.encode('date', datetime.datetime(2000, 1, 11, 12)),
+            struct.pack('>i', 10)
+        )
+
+    def test_timestamp(self):
+        # microseconds since 2000-01-01
+        self.assertEqual(
+            self.encode('timestamp', datetime.datetime(2000, 1, 1, 0, 0, 1)),
+            struct.pack('>q', 1000000)
+        )
+        self.assertEqual(self.encode('timestamp', '2000-01-02 00:00:00'),
+                         struct.pack('>q', 86400 * 1000000))
+        self.assertEqual(self.encode('timestamp', datetime.date(1999, 12, 31)),
+                         struct.pack('>q', -86400 * 1000000))
+
+    def numeric(self, ndigits, weight, sign, dscale, digits):
+        return (struct.pack('>hhHH', ndigits, weight, sign, dscale) +
+                struct.pack('>%dh' % len(digits), *digits))
+
+    def test_numeric(self):
+        # base 10000 digits, weight is the position of the first digit
+        self.assertEqual(self.encode('numeric', Decimal('12345.678')),
+                         self.numeric(3, 1, copy_util.NUMERIC_POS, 3,
+                                      [1, 2345, 6780]))
+        self.assertEqual(self.encode('numeric', '-0.05'),
+                         self.numeric(1, -1, copy_util.NUMERIC_NEG, 2,
+                                      [500]))
+        self.assertEqual(self.encode('numeric', '120000'),
+                         self.numeric(1, 1, copy_util.NUMERIC_POS, 0,
+                                      [12]))
+        self.assertEqual(self.encode('numeric', '0'),
+                         self.numeric(0, 0, copy_util.NUMERIC_POS, 0, []))
+        self.assertEqual(self.encode('numeric', 'NaN'),
+                         self.numeric(0, 0, copy_util.NUMERIC_NAN, 0, []))
+
+    def test_unreadable_date(self):
+        # copy_rows sends the batch as text for the server to parse
+        self.assertRaises(ValueError, self.encode, 'date', '03/02/2016')
+
+    def test_unknown_type(self):
+        self.assertRaises(Exception, copy_util.binary_encoders, ['point'])
+
+    def test_buffer(self):
+        encoders = copy_util.binary_encoders(['integer', 'text'])
+        buf = copy_util.binary_buffer([(1, None), (2, 'ab')], encoders)
+        expected = (
+            copy_util.BINARY_SIGNATURE + struct.pack('>ii', 0, 0) +
+            struct.pack('>h', 2) +
+            struct.pack('>i', 4) + struct.pack('>i', 1) +
+            struct.pack('>i', -1) +
+            struct.pack('>h', 2) +
+            struct.pack('>i', 4) + struct.pack('>i', 2) +
+            struct.pack('>i', 2) + 'ab' +
+            struct.pack('>h', -1)
+        )
+        self.assertEqual(buf.read(), expected)
+
+
+class FakeConnection(object):
+    ''' Records what copy_rows sends '''
+
+    encoding = 'LATIN1'
+
+    def __init__(self):
+        self.copied = []
+
+    def cursor(self):
+        return self
+
+    def copy_expert(self, sql, buf):
+        self.copied.append((sql, buf.read()))
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CopyRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = sa_util.engine
+        self.connection = FakeConnection()
+        sa_util.engine = self
+        self.fields = [
+            {'name': 'name', 'type': 'text'},
+            {'name': 'opened', 'type': 'date'},
+        ]
+
+    def tearDown(self):
+        sa_util.engine = self.engine
+
+    def raw_connection(self):
+        return self.connection
+
+    def test_client_encoding(self):
+        copy_util.copy_rows('t', self.fields, [(u'caf\xe9', None)])
+        self.assertEqual(self.connection.copied, [
+            ('COPY "t" ("name", "opened") FROM STDIN', 'caf\xe9\t\\N\n'),
+        ])
+
+    def test_binary(self):
+        copy_util.copy_rows('t', self.fields, [(u'caf\xe9', '2000-01-02')],
+                            binary=True)
+        sql, data = self.connection.copied[0]
+        self.assertEqual(sql, 'COPY "t" ("name", "opened") FROM STDIN '
+                              'WITH (FORMAT binary)')
+        self.assertTrue(data.startswith(copy_util.BINARY_SIGNATURE))
+        self.assertTrue('caf\xe9' in data)
+
+    def test_binary_falls_back_to_text(self):
+        checksum = hashlib.md5()
+        copy_util.copy_rows('t', self.fields, [(u'x', '03/02/2016')],
+                            binary=True, checksum=checksum)
+        self.assertEqual(self.connection.copied, [
+            ('COPY "t" ("name", "opened") FROM STDIN', 'x\t03/02/2016\n'),
+        ])
+        self.assertEqual(checksum.hexdigest(),
+                         hashlib.md5('x\t03/02/2016\n').hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from munge import dependencies
+
+
+class TopologicalSortTest(unittest.TestCase):
+
+    def sort(self, deps):
+        return dependencies.topological_sort(
+            deps, dependencies.direct_dependants(deps)
+        )
+
+    def test_direct_dependants(self):
+        deps = {'v_view': ['table_a'], 's_summary': ['v_view', 'table_a']}
+        self.assertEqual(dependencies.direct_dependants(deps), {
+            'table_a': set(['v_view', 's_summary']),
+            'v_view': set(['s_summary']),
+            's_summary': set(),
+        })
+
+    def test_dependencies_come_first(self):
+        deps = {
+            's_summary': ['v_view', 'table_a'],
+            'v_view': ['table_a', 'table_b'],
+        }
+        ordered = self.sort(deps)
+        self.assertEqual(sorted(ordered),
+                         ['s_summary', 'table_a', 'table_b', 'v_view'])
+        for item, needs in deps.items():
+            for dep in needs:
+                self.assertTrue(ordered.index(dep) < ordered.index(item))
+
+    def test_ties_broken_by_name(self):
+        deps = {'c': ['a'], 'b': ['a'], 'd': []}
+        self.assertEqual(self.sort(deps), ['a', 'b', 'c', 'd'])
+
+    def test_cycle(self):
+        deps = {'a': ['b'], 'b': ['c'], 'c': ['b'], 'd': ['a']}
+        try:
+            self.sort(deps)
+        except Exception as e:
+            self.assertEqual(str(e), 'Dependency cycle: b -> c -> b')
+        else:
+            self.fail('cycle not found')
+
+
+class FindCycleTest(unittest.TestCase):
+
+    def test_self_cycle(self):
+        deps = {'a': ['a']}
+        self.assertEqual(dependencies.find_cycle(deps, set(['a'])),
+                         ['a', 'a'])
+
+    def test_items_behind_a_cycle(self):
+        # a is not in the cycle but depends on it
+        deps = {'a': ['b'], 'b': ['c'], 'c': ['d'], 'd': ['b']}
+        self.assertEqual(
+            dependencies.find_cycle(deps, set(['a', 'b', 'c', 'd'])),
+            ['b', 'c', 'd', 'b']
+        )
+
+    def test_ignores_items_outside(self):
+        deps = {'a': ['x', 'b'], 'b': ['a'], 'x': []}
+        self.assertEqual(dependencies.find_cycle(deps, set(['a', 'b'])),
+                         ['a', 'b', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
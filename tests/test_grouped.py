@@ -0,0 +1,57 @@
+import unittest
+
+from munge import grouped
+from munge.grouped import GroupedValues
+
+
+class GroupedValuesTest(unittest.TestCase):
+
+    def make(self):
+        store = GroupedValues(['m2', 'price'])
+        store.add('b', 10.0, 100.0)
+        store.add('a', 1.0, None)
+        store.add('a', 3.0, 5.0)
+        store.add('a', 2.0, 7.0)
+        store.add('a', 4.0, None)
+        return store
+
+    def test_keys_sorted(self):
+        self.assertEqual(self.make().keys(), ['a', 'b'])
+
+    def test_counts_ignore_none(self):
+        store = self.make()
+        self.assertEqual(store.count('a'), 4)
+        self.assertEqual(store.count('a', 'm2'), 4)
+        self.assertEqual(store.count('a', 'price'), 2)
+        self.assertEqual(store.count('b', 'price'), 1)
+
+    def check_stats(self):
+        store = self.make()
+        self.assertEqual(store.median('a', 'm2'), 2.5)
+        self.assertEqual(store.median('a', 'price'), 6.0)
+        self.assertEqual(store.median('b', 'm2'), 10.0)
+        # linear interpolation between closest ranks, as percentile_cont
+        self.assertAlmostEqual(store.percentile('a', 'm2', 25), 1.75)
+        self.assertEqual(store.percentile('a', 'm2', 0), 1.0)
+        self.assertEqual(store.percentile('a', 'm2', 100), 4.0)
+
+    def test_stats(self):
+        self.check_stats()
+
+    def test_stats_without_numpy(self):
+        numpy = grouped.numpy
+        grouped.numpy = None
+        try:
+            self.check_stats()
+        finally:
+            grouped.numpy = numpy
+
+    def test_no_values(self):
+        store = GroupedValues(['m2'])
+        store.add('a', None)
+        self.assertEqual(store.count('a'), 1)
+        self.assertEqual(store.median('a', 'm2'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import datetime
+import json
+import unittest
+
+from munge import app
+
+
+class KeysetSqlTest(unittest.TestCase):
+
+    sql = 'SELECT name{keys} FROM t'
+    keys = ['"la_code"', '"id"']
+
+    def test_first_page(self):
+        sql, params = app.keyset_sql(self.sql, self.keys)
+        self.assertEqual(sql, (
+            'SELECT * FROM (\n'
+            'SELECT name, "la_code" AS _key0, "id" AS _key1 FROM t\n'
+            ') AS q \n'
+            'ORDER BY q._key0, q._key1 LIMIT %s' % app.PAGE_SIZE
+        ))
+        self.assertEqual(params, {})
+
+    def test_after(self):
+        sql, params = app.keyset_sql(self.sql, self.keys, '["E06", 7]')
+        self.assertTrue(
+            'WHERE (q._key0, q._key1) > (:_after_key0, :_after_key1)' in sql
+        )
+        self.assertEqual(params, {'_after_key0': 'E06', '_after_key1': 7})
+
+    def test_next_after_round_trip(self):
+        last = [u'E06', datetime.date(2016, 2, 3), None]
+        after = json.dumps([app.json_key_value(value) for value in last])
+        sql, params = app.keyset_sql(self.sql, ['a', 'b', 'c'], after)
+        self.assertEqual(params, {
+            '_after_key0': 'E06',
+            '_after_key1': '2016-02-03',
+            '_after_key2': None,
+        })
+
+    def test_bad_after(self):
+        for after in ['[1', 'x', '{"a": 1}', '5', '[1]', '[1, 2, 3]',
+                      '[1, [2]]', '[{}, 2]']:
+            self.assertRaises(ValueError, app.keyset_sql,
+                              self.sql, self.keys, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
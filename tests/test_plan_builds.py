@@ -0,0 +1,93 @@
+import unittest
+
+from munge import config, definitions, sa_util, summeries
+
+
+TEMP = config.TEMP_TABLE_STR
+
+DEFINITIONS = {
+    'vao_list': {
+        'name': 'vao_list',
+        'sql': 'SELECT * FROM {t0}',
+        'tables': ['vao_list_raw'],
+        'as_view': True,
+    },
+    's_vao_summary': {
+        'name': 's_vao_summary',
+        'sql': 'SELECT count(*) FROM {t0}',
+        'tables': ['vao_list'],
+    },
+}
+
+
+class PlanBuildsTest(unittest.TestCase):
+    ''' plan_builds with the definitions, stored fingerprints and database
+    objects replaced '''
+
+    def setUp(self):
+        self.saved = (definitions.get_definition, summeries.get_fingerprints,
+                      sa_util.table_view_list)
+        definitions.get_definition = DEFINITIONS.get
+        summeries.get_fingerprints = lambda: dict(self.stored)
+        sa_util.table_view_list = lambda: list(self.existing)
+        self.existing = ['vao_list_raw', 'vao_list', 's_vao_summary']
+        self.stored = {'vao_list_raw': 'raw1'}
+        # fingerprints of a previous build
+        builds, fingerprints, skipped = self.plan()
+        self.stored.update(fingerprints)
+
+    def tearDown(self):
+        (definitions.get_definition, summeries.get_fingerprints,
+         sa_util.table_view_list) = self.saved
+
+    def plan(self, incremental=True):
+        return sa_util.plan_builds(['vao_list', 's_vao_summary'],
+                                   incremental)
+
+    def test_unchanged_skipped(self):
+        builds, fingerprints, skipped = self.plan()
+        self.assertEqual(builds, [])
+        self.assertEqual([item for item, reason in skipped],
+                         ['vao_list', 's_vao_summary'])
+
+    def test_full_rebuild(self):
+        builds, fingerprints, skipped = self.plan(incremental=False)
+        self.assertEqual([item for item, reason in builds],
+                         ['vao_list', 's_vao_summary'])
+
+    def test_changed_input(self):
+        self.stored['vao_list_raw'] = 'raw2'
+        builds, fingerprints, skipped = self.plan()
+        self.assertEqual(builds, [
+            ('vao_list', 'sql or inputs changed'),
+            ('s_vao_summary', 'sql or inputs changed'),
+        ])
+
+    def test_reimported_input_with_same_data(self):
+        # the view must be rebuilt on the new table or it stops the old
+        # one being dropped when the tables are swapped
+        self.existing.append(TEMP + 'vao_list_raw')
+        builds, fingerprints, skipped = self.plan()
+        self.assertEqual(builds, [
+            ('vao_list', 'vao_list_raw to be swapped'),
+            ('s_vao_summary', 'vao_list to be swapped'),
+        ])
+        self.assertEqual(skipped, [])
+
+    def test_waiting_temp_table(self):
+        self.existing.append(TEMP + 's_vao_summary')
+        builds, fingerprints, skipped = self.plan()
+        self.assertEqual(builds, [
+            ('s_vao_summary', 'temp table waiting to be swapped'),
+        ])
+
+    def test_unknown_input(self):
+        del self.stored['vao_list_raw']
+        builds, fingerprints, skipped = self.plan()
+        self.assertEqual(builds[0],
+                         ('vao_list', 'no fingerprint for vao_list_raw'))
+        self.assertEqual(fingerprints['vao_list'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()
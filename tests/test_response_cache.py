@@ -0,0 +1,43 @@
+import unittest
+
+from munge.response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_get_and_set(self):
+        cache = ResponseCache(2)
+        self.assertEqual(cache.get('/la/', 1), None)
+        cache.set('/la/', 1, 'page')
+        self.assertEqual(cache.get('/la/', 1), 'page')
+        self.assertEqual(cache.stats(), {
+            'size': 1, 'max_size': 2, 'hits': 1, 'misses': 1,
+        })
+
+    def test_new_version(self):
+        # the tables have been updated since the response was made
+        cache = ResponseCache(2)
+        cache.set('/la/', 1, 'page')
+        self.assertEqual(cache.get('/la/', 2), None)
+        # and the stale entry is gone
+        self.assertEqual(cache.get('/la/', 1), None)
+
+    def test_least_recently_used_dropped(self):
+        cache = ResponseCache(2)
+        cache.set('a', 1, 'A')
+        cache.set('b', 1, 'B')
+        cache.get('a', 1)
+        cache.set('c', 1, 'C')
+        self.assertEqual(cache.get('b', 1), None)
+        self.assertEqual(cache.get('a', 1), 'A')
+        self.assertEqual(cache.get('c', 1), 'C')
+
+    def test_clear(self):
+        cache = ResponseCache(2)
+        cache.set('a', 1, 'A')
+        cache.clear()
+        self.assertEqual(cache.get('a', 1), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import datetime
+import unittest
+
+from munge import csv_util
+from munge.common import process_header
+
+
+class RowConverterTest(unittest.TestCase):
+
+    def convert(self, header, row):
+        return csv_util.row_converter(process_header(header))(row)
+
+    def test_auto_conversions(self):
+        header = ['*id:integer', 'name', 'area:float', 'open:boolean']
+        self.assertEqual(self.convert(header, ['7', 'x', '1.5', 'Yes']),
+                         (7, 'x', 1.5, True))
+        self.assertEqual(self.convert(header, ['8', '', '', '']),
+                         (8, '', None, None))
+
+    def test_named_function(self):
+        header = ['opened:date~make_date_YYYY_MM_DD', 'pc~compact_pc']
+        self.assertEqual(self.convert(header, ['2016-02-03 10:00', 'ab1 2c']),
+                         (datetime.date(2016, 2, 3), 'AB12C'))
+
+    def test_ignored_and_missing_fields(self):
+        # ignored columns are read but not output, missing ones are made
+        # from other columns
+        header = ['-skip', 'postcode', '@outcode~outcode|postcode']
+        self.assertEqual(self.convert(header, ['z', 'AB1 2CD']),
+                         ('AB1 2CD', 'AB1'))
+
+    def test_single_field(self):
+        self.assertEqual(self.convert(['n:integer'], ['3']), (3,))
+
+    def test_extra_values_dropped(self):
+        self.assertEqual(self.convert(['a', 'b'], ['1', '2', '3']),
+                         ('1', '2'))
+
+    def test_short_row(self):
+        try:
+            self.convert(['a', 'b'], ['1'])
+        except csv_util.ConversionError as e:
+            self.assertEqual(e.field, None)
+            self.assertTrue(isinstance(e.error, IndexError))
+        else:
+            self.fail('short row accepted')
+
+    def test_bad_value(self):
+        try:
+            self.convert(['a', 'n:integer'], ['1', 'x'])
+        except csv_util.ConversionError as e:
+            self.assertEqual(e.field, 'n')
+            self.assertTrue(isinstance(e.error, ValueError))
+        else:
+            self.fail('bad value accepted')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from munge import workers
+
+
+def touch(path, name):
+    open(os.path.join(path, name), 'w').close()
+
+
+def needs(path, name, needed):
+    ''' Fails unless the jobs in needed have already run '''
+    for item in needed:
+        if not os.path.exists(os.path.join(path, item)):
+            raise Exception('%s has not run' % item)
+    touch(path, name)
+
+
+def fail():
+    raise Exception('failed')
+
+
+def die():
+    os._exit(1)
+
+
+class RunGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.poll_interval = workers.POLL_INTERVAL
+        workers.POLL_INTERVAL = 0.1
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        workers.POLL_INTERVAL = self.poll_interval
+
+    def job(self, name, needed=None):
+        return (name, needs, [self.path, name, needed or []], {})
+
+    def ran(self):
+        return sorted(os.listdir(self.path))
+
+    def check_order(self, count):
+        jobs = [
+            self.job('a'),
+            self.job('b', ['a']),
+            self.job('c', ['a']),
+            self.job('d', ['b', 'c']),
+        ]
+        dependencies = {'b': ['a'], 'c': ['a'], 'd': ['b', 'c']}
+        errors = workers.run_graph(jobs, dependencies, workers=count)
+        self.assertEqual(errors, {})
+        self.assertEqual(self.ran(), ['a', 'b', 'c', 'd'])
+
+    def test_order(self):
+        self.check_order(1)
+
+    def test_order_in_pool(self):
+        self.check_order(2)
+
+    def test_dependants_of_failed_job_skipped(self):
+        jobs = [
+            ('a', fail, [], {}),
+            self.job('b', ['a']),
+            self.job('c'),
+        ]
+        errors = workers.run_graph(jobs, {'b': ['a']}, workers=1)
+        self.assertEqual(sorted(errors), ['a', 'b'])
+        self.assertTrue('failed' in errors['a'])
+        self.assertEqual(errors['b'], 'skipped, depends on a')
+        self.assertEqual(self.ran(), ['c'])
+
+    def test_dependencies_outside_jobs_ignored(self):
+        errors = workers.run_graph([self.job('a')], {'a': ['x']}, workers=1)
+        self.assertEqual(errors, {})
+
+    def test_worker_died(self):
+        jobs = [
+            ('a', die, [], {}),
+            self.job('b', ['a']),
+        ]
+        errors = workers.run_graph(jobs, {'b': ['a']}, workers=2)
+        self.assertEqual(errors, {
+            'a': 'worker process died, build aborted',
+            'b': 'skipped, build aborted',
+        })
+
+
+class CriticalPathTest(unittest.TestCase):
+
+    def test_slowest_chain(self):
+        dependencies = {'b': ['a'], 'c': ['a'], 'd': ['b', 'c']}
+        timings = {'a': 1, 'b': 5, 'c': 2, 'd': 1}
+        self.assertEqual(workers.critical_path(dependencies, timings),
+                         (7, ['a', 'b', 'd']))
+
+    def test_nothing_built(self):
+        self.assertEqual(workers.critical_path({}, {}), (0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()